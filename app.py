@@ -1,67 +1,369 @@
-from flask import Flask, jsonify, render_template_string, request
+import os
+
+ASYNC_MODE = os.environ.get("ASYNC_MODE", "threading")
+# Tournament heat workers are spawned and re-import this file as __mp_main__;
+# they only run physics, so they must not patch the standard library.
+if ASYNC_MODE == "eventlet" and __name__ != "__mp_main__":
+    import eventlet
+
+    eventlet.monkey_patch()
+
+from flask import Flask, Response, jsonify, request
 from flask_socketio import SocketIO, emit, join_room
 from flask_cors import CORS
+import json
+import math
 import threading
+import time
 import uuid
 
+import frame_codecs
+from client_assets import ClientAssets
+from encoder_pool import ENCODER_WORKERS, EncoderPool
+from frames import frame_room
 from physics_engine import PhysicsEngine
+from profiler import ProfilerBusy, sample_stacks
+from race_batch import BATCH_MAX_NAMES, RaceBatch
+from recorder import DELTA, RaceRecorder, RaceReplay, recording_path
+from relay import RelayPublisher, get_authkey, parse_address
+from session_manager import Session, SessionLimitError, SessionManager
+from step_policy import make_step_policy
+from tournament import needs_tournament, run_heats, shutdown_executor, split_heats
+from track import DEFAULT_TRACK, TrackError, get_track_by_hash, load_track
+from viewers import ViewerRegistry
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = "roulette-secret"
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode="threading")
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE)
+
+ALLOW_SLEEP = os.environ.get("ALLOW_SLEEP", "0") == "1"
+RELAY_PUBLISH = os.environ.get("RELAY_PUBLISH")
+BATCH_SMALL_RACES = os.environ.get("BATCH_SMALL_RACES", "0") == "1"
+HEADLESS_STEPS_PER_TICK = int(os.environ.get("HEADLESS_STEPS_PER_TICK", 1))
+FRAME_STALE_SECONDS = 0.1
+FRAME_WAIT_SECONDS = 0.5
+HEAT_POLL_SECONDS = 0.05
+
+client_assets = None
+relay_publisher = None
+encoder_pool = None
+
+
+def latest_payload(session_id):
+    session = get_session(session_id)
+    frame = session.frame if session else None
+    return frame.payload if frame else None
+
+
+client_formats = {}
+viewers = ViewerRegistry()
+race_batches = []
+batch_lock = threading.Lock()
+
+
+def close_session(session):
+    if session.closed:
+        return
+    session.closed = True
+    broadcast("session_closed", {"session_id": session.session_id}, session.session_id)
+
 
-active_sessions = {}
-session_lock = threading.Lock()
+session_manager = SessionManager(on_reap=close_session)
 
 
 def get_session(session_id):
-    with session_lock:
-        return active_sessions.get(session_id)
+    return session_manager.get(session_id)
 
 
-def register_session(session_id, engine):
-    with session_lock:
-        if session_id in active_sessions:
-            return False
-        active_sessions[session_id] = engine
-        return True
+def client_number(data, key, default):
+    value = data.get(key)
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"{key} must be a number")
+    return float(value)
 
 
-def remove_session(session_id):
-    with session_lock:
-        return active_sessions.pop(session_id, None)
+def wait_heats(futures):
+    # The heat pool's management thread is created by whichever thread first
+    # submits, so under eventlet it must stay on the hub: poll the futures
+    # cooperatively instead of parking a tpool thread on them.
+    while not all(future.done() for future in futures):
+        socketio.sleep(HEAT_POLL_SECONDS)
 
 
 @app.route("/")
 def index():
-    names = request.args.get("names", "")
-    rank = request.args.get("rank", "")
-    session_id = request.args.get("session_id", "")
-    return render_template_string(
-        HTML_TEMPLATE,
-        names=names,
-        rank=rank,
-        session_id=session_id,
-    )
+    return client_assets.serve_shell(request)
+
+
+@app.route("/assets/<name>")
+def asset(name):
+    return client_assets.serve_asset(name, request)
+
+
+@app.route("/tracks/<track_hash>")
+def track_payload(track_hash):
+    track = get_track_by_hash(track_hash)
+    if track is None:
+        return jsonify({"success": False, "message": "Track not found"}), 404
+    return client_assets.serve_track(track, request)
 
 
 @app.route("/stop_lottery_http", methods=["POST"])
 def stop_lottery_http():
     data = request.get_json(silent=True) or {}
     session_id = data.get("session_id")
-    engine = remove_session(session_id)
-    if engine:
-        engine.stop()
+    session = session_manager.pop(session_id)
+    if session:
+        session.engine.stop()
         print(f"Session stopped by admin: {session_id}")
         return jsonify({"success": True}), 200
     return jsonify({"success": False, "message": "Session not found"}), 404
 
 
+@app.route("/profile_http", methods=["POST"])
+def profile_http():
+    data = request.get_json(silent=True) or {}
+    session_id = data.get("session_id")
+    try:
+        seconds = client_number(data, "seconds", 5)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    include = None
+    if session_id:
+        session = get_session(session_id)
+        if session is None or session.thread_id is None:
+            return jsonify({"success": False, "message": "Session not found"}), 404
+
+        # Since frames are emitted from the encoder pool, the session's
+        # emit time is spent on whichever worker is running its job.
+        def include(task_id):
+            if task_id == session.thread_id:
+                return True
+            return bool(encoder_pool and encoder_pool.is_running(task_id, session))
+
+    try:
+        stacks = sample_stacks(seconds, include)
+    except ProfilerBusy as e:
+        return jsonify({"success": False, "message": str(e)}), 409
+    print(f"Profiled {session_id or 'process'} for {seconds}s")
+    return Response(stacks, mimetype="text/plain")
+
+
+@app.route("/session_state/<session_id>")
+def session_state(session_id):
+    session = get_session(session_id)
+    if session is None:
+        return jsonify({"success": False, "message": "Session not found"}), 404
+
+    # Sessions nobody watches stop publishing, so ask the loop for a fresh
+    # frame and give it a couple of ticks to produce one.
+    frame = session.frame
+    if frame is None or time.time() - frame.created_at > FRAME_STALE_SECONDS:
+        session.frame_wanted = True
+        deadline = time.monotonic() + FRAME_WAIT_SECONDS
+        while session.frame is frame and not session.closed and time.monotonic() < deadline:
+            socketio.sleep(0.01)
+        frame = session.frame
+    if frame is None:
+        return jsonify({"success": False, "message": "Session has no frame yet"}), 503
+
+    response = Response(frame.payload, mimetype="application/json")
+    response.headers["X-Frame-Age"] = f"{time.time() - frame.created_at:.3f}"
+    response.headers["X-Session-Running"] = "1" if session.engine.is_running else "0"
+    return response
+
+
+def broadcast(event, payload, room):
+    socketio.emit(event, payload, to=room)
+    if relay_publisher and relay_publisher.has_subscribers(room):
+        if not isinstance(payload, str):
+            payload = json.dumps(payload)
+        relay_publisher.publish(event, room, payload)
+
+
+def broadcast_frame(session, frame):
+    session_id = session.session_id
+    for fmt in viewers.formats(session_id):
+        socketio.emit("physics_update", frame.encode(fmt), to=frame_room(session_id, fmt))
+    if relay_publisher and relay_publisher.has_subscribers(session_id):
+        relay_publisher.publish("physics_update", session_id, frame.payload)
+
+
+def deliver_frame(session, frame):
+    broadcast_frame(session, frame)
+    if session.recorder:
+        session.recorder.record(frame)
+
+
+def has_audience(session):
+    if viewers.count(session.session_id) or session.recorder or session.frame_wanted:
+        return True
+    return bool(relay_publisher and relay_publisher.has_subscribers(session.session_id))
+
+
+def publish_tick(session, state):
+    frame = session.publish(state)
+    if encoder_pool:
+        encoder_pool.submit(session, lambda: deliver_frame(session, frame))
+    else:
+        deliver_frame(session, frame)
+
+
+def publish_if_watched(session):
+    # Rooms nobody is watching (no sockets, relays or recorder) skip building
+    # and encoding the state entirely; the next tick after a join resumes.
+    if not has_audience(session):
+        session.record_skip()
+        return False
+    session.frame_wanted = False
+    state_start = time.perf_counter()
+    state = session.engine.get_state()
+    session.record_state_time(time.perf_counter() - state_start)
+    publish_tick(session, state)
+    return True
+
+
+def start_recording(session):
+    path = recording_path(session.session_id)
+    if path:
+        session.recorder = RaceRecorder(path)
+
+
+def finish_session(session):
+    if encoder_pool:
+        encoder_pool.wait_idle(session)
+    if session.recorder:
+        session.recorder.close()
+        session.recorder = None
+    session_manager.remove(session)
+    close_session(session)
+    print(f"Session cleaned up: {session.session_id}")
+
+
+def emit_latest_frame(session):
+    frame = session.frame if session else None
+    if frame is not None:
+        emit("physics_update", frame.encode(client_formats.get(request.sid, frame_codecs.DEFAULT_FORMAT)))
+
+
+def join_session_rooms(session_id):
+    fmt = client_formats.get(request.sid, frame_codecs.DEFAULT_FORMAT)
+    join_room(session_id)
+    join_room(frame_room(session_id, fmt))
+    viewers.join(session_id, request.sid, fmt)
+
+
+@app.route("/replay/<session_id>")
+def replay_http(session_id):
+    path = recording_path(session_id)
+    if not path or not os.path.exists(path):
+        return jsonify({"success": False, "message": "Recording not found"}), 404
+
+    try:
+        replay = RaceReplay(path)
+    except (OSError, ValueError):
+        return jsonify({"success": False, "message": "Recording not found"}), 404
+    offset = replay.seek(request.args.get("t", 0, type=float))
+
+    def generate():
+        try:
+            yield from replay.chunks(offset)
+        finally:
+            replay.close()
+
+    return Response(generate(), mimetype="application/octet-stream")
+
+
+def stream_replay(sid, session_id, path, start_t, speed):
+    try:
+        replay = RaceReplay(path)
+    except (OSError, ValueError):
+        socketio.emit("replay_end", {"session_id": session_id, "success": False}, to=sid)
+        return
+
+    try:
+        offset = replay.seek(start_t)
+        first_t = None
+        wall_start = None
+        while sid in client_formats:
+            # Frames written just before the race ended (or was recorded
+            # again) are only visible after a remap, so drain once more.
+            finished = get_session(session_id) is None or replay.is_replaced()
+            replay.remap()
+            for kind, t, payload, offset in replay.records(offset):
+                if sid not in client_formats:
+                    return
+                if t >= start_t:
+                    if first_t is None:
+                        first_t = t
+                        wall_start = time.monotonic()
+                    delay = (t - first_t) / speed - (time.monotonic() - wall_start)
+                    if delay > 0:
+                        socketio.sleep(delay)
+                socketio.emit(
+                    "replay_frame",
+                    {"delta": kind == DELTA, "t": t, "payload": str(payload, "utf-8")},
+                    to=sid,
+                )
+            if finished:
+                break
+            socketio.sleep(0.033)
+    finally:
+        replay.close()
+        socketio.emit("replay_end", {"session_id": session_id, "success": True}, to=sid)
+
+
+@socketio.on("replay")
+def handle_replay(data):
+    data = data if isinstance(data, dict) else {}
+    session_id = data.get("session_id")
+    try:
+        if not isinstance(session_id, str):
+            raise ValueError("session_id must be a string")
+        start_t = client_number(data, "t", 0)
+        speed = max(client_number(data, "speed", 1), 0.1)
+    except ValueError:
+        session_id = session_id if isinstance(session_id, str) else None
+        emit("replay_end", {"session_id": session_id, "success": False})
+        return
+
+    path = recording_path(session_id)
+    if not path or not os.path.exists(path):
+        emit("replay_end", {"session_id": session_id, "success": False})
+        return
+
+    socketio.start_background_task(stream_replay, request.sid, session_id, path, start_t, speed)
+    print(f"Replaying {session_id} from {start_t}s")
+
+
+@app.route("/sessions")
+def sessions_status():
+    stats = session_manager.get_stats()
+    stats["viewers"] = viewers.get_stats()
+    if encoder_pool:
+        stats["encoder"] = encoder_pool.get_stats()
+    return jsonify(stats)
+
+
+@app.route("/codec_stats")
+def codec_stats():
+    return jsonify({
+        "server_formats": frame_codecs.SERVER_FORMATS,
+        "codecs": frame_codecs.get_stats(),
+    })
+
+
 @socketio.on("connect")
-def handle_connect():
-    print("Client connected")
-    emit("connected", {"status": "ready"})
+def handle_connect(auth=None):
+    formats = auth.get("formats") if isinstance(auth, dict) else None
+    fmt = frame_codecs.negotiate_format(formats)
+    client_formats[request.sid] = fmt
+    print(f"Client connected (format: {fmt})")
+    emit("connected", {"status": "ready", "format": fmt})
 
 
 @socketio.on("join")
@@ -70,10 +372,11 @@ def on_join(data):
     if not session_id:
         return
 
-    join_room(session_id)
-    engine = get_session(session_id)
-    if engine:
-        emit("physics_update", engine.get_state())
+    join_session_rooms(session_id)
+    session = get_session(session_id)
+    if session:
+        session.touch()
+        emit_latest_frame(session)
     print(f"Client joined room: {session_id}")
 
 
@@ -83,10 +386,11 @@ def handle_rejoin(data):
     if not session_id:
         return
 
-    join_room(session_id)
-    engine = get_session(session_id)
-    if engine:
-        emit("physics_update", engine.get_state())
+    join_session_rooms(session_id)
+    session = get_session(session_id)
+    if session:
+        session.touch()
+        emit_latest_frame(session)
         emit("session_restored", {"success": True})
         print(f"Client rejoined session: {session_id}")
     else:
@@ -103,49 +407,194 @@ def handle_start(data):
         emit("session_error", {"message": "No participants provided"})
         return
 
-    existing_engine = get_session(session_id)
-    if existing_engine:
+    try:
+        rank = int(data.get("rank") or 1)
+    except (TypeError, ValueError):
+        emit("session_error", {"message": "rank must be a whole number"})
+        return
+    rank = min(max(rank, 1), len(names))
+
+    try:
+        track = load_track(data.get("track") or DEFAULT_TRACK)
+    except TrackError as e:
+        emit("session_error", {"message": str(e)})
+        return
+
+    existing_session = get_session(session_id)
+    if existing_session:
         emit("session_started", {"session_id": session_id})
-        emit("physics_update", existing_engine.get_state())
+        emit_latest_frame(existing_session)
         print(f"Session {session_id} already running, ignoring duplicate start")
         return
 
-    physics_engine = PhysicsEngine(names)
-    if not register_session(session_id, physics_engine):
-        engine = get_session(session_id)
+    if needs_tournament(names):
+        if not session_manager.reserve_tournament(session_id):
+            emit("session_started", {"session_id": session_id})
+            return
+
+        heats = split_heats(names)
+        print(f"Starting tournament {session_id} with {len(names)} participants in {len(heats)} heats")
+
+        def tournament_task():
+            try:
+                finalists = run_heats(
+                    names, rank=rank, allow_sleep=ALLOW_SLEEP, track_name=track.name,
+                    wait=wait_heats,
+                )
+            except Exception as e:
+                print(f"Tournament {session_id} failed: {e}")
+                broadcast("session_error", {"message": "Tournament heats failed"}, session_id)
+                return
+            finally:
+                session_manager.release_tournament(session_id)
+
+            broadcast(
+                "tournament_final",
+                {"session_id": session_id, "finalists": len(finalists)},
+                session_id,
+            )
+            try:
+                launch_session(session_id, finalists, track)
+            except SessionLimitError as e:
+                broadcast("session_error", {"message": str(e)}, session_id)
+
+        socketio.start_background_task(tournament_task)
+
         emit("session_started", {"session_id": session_id})
-        if engine:
-            emit("physics_update", engine.get_state())
+        broadcast(
+            "tournament_started",
+            {"session_id": session_id, "heats": len(heats)},
+            session_id,
+        )
         return
 
+    try:
+        launched = launch_session(session_id, names, track)
+    except SessionLimitError as e:
+        emit("session_error", {"message": str(e)})
+        return
+
+    if not launched:
+        emit("session_started", {"session_id": session_id})
+        emit_latest_frame(get_session(session_id))
+        return
+
+    emit("session_started", {"session_id": session_id})
+
+
+def launch_session(session_id, names, track):
+    session_manager.check_capacity(len(names))
+    if BATCH_SMALL_RACES and len(names) <= BATCH_MAX_NAMES:
+        return launch_batched_session(session_id, names, track)
+
+    physics_engine = PhysicsEngine(
+        names, allow_sleep=ALLOW_SLEEP, track=track, step_policy=make_step_policy()
+    )
+    session = Session(session_id, physics_engine)
+    if not session_manager.register(session):
+        return False
+
     print(f"Starting session {session_id} with {len(names)} participants")
     physics_engine.start()
 
     def simulation_loop():
-        while True:
-            state = physics_engine.update()
-            socketio.emit("physics_update", state, to=session_id)
-            if not physics_engine.is_running and not physics_engine.skill_effects:
+        session.thread_id = threading.get_ident()
+        try:
+            start_recording(session)
+            while physics_engine.is_running or physics_engine.skill_effects:
+                tick_start = time.perf_counter()
+                physics_engine.step()
+                if not publish_if_watched(session):
+                    for _ in range(HEADLESS_STEPS_PER_TICK - 1):
+                        if not physics_engine.is_running:
+                            break
+                        physics_engine.step()
+                session.record_tick(time.perf_counter() - tick_start)
+                socketio.sleep(0.033)
+        except Exception as e:
+            print(f"Session {session_id} crashed: {e}")
+        finally:
+            finish_session(session)
+
+    session.task = socketio.start_background_task(simulation_loop)
+    return True
+
+
+def launch_batched_session(session_id, names, track):
+    with batch_lock:
+        physics_engine = None
+        for batch in race_batches:
+            physics_engine = batch.add_race(names, track)
+            if physics_engine:
                 break
+        else:
+            batch = RaceBatch(ALLOW_SLEEP)
+            race_batches.append(batch)
+            physics_engine = batch.add_race(names, track)
+            batch.task = socketio.start_background_task(batch_loop, batch)
+
+    session = Session(session_id, physics_engine)
+    try:
+        registered = session_manager.register(session)
+    except SessionLimitError:
+        batch.remove_race(physics_engine)
+        raise
+    if not registered:
+        batch.remove_race(physics_engine)
+        return False
+
+    print(f"Starting batched session {session_id} with {len(names)} participants")
+    session.task = batch.task
+    try:
+        start_recording(session)
+    except Exception as e:
+        print(f"Session {session_id} recording failed: {e}")
+    physics_engine.start()
+    batch.set_owner(physics_engine, session)
+    return True
+
+
+def batch_loop(batch):
+    thread_id = threading.get_ident()
+    sessions = []
+    try:
+        while not batch.retire_if_idle():
+            tick_start = time.perf_counter()
+            races = batch.step()
+            sessions = [session for _, session in races if session is not None]
+            for physics_engine, session in races:
+                if session is None:
+                    continue
+                session.thread_id = thread_id
+                try:
+                    publish_if_watched(session)
+                    if not physics_engine.is_running and not physics_engine.skill_effects:
+                        batch.remove_race(physics_engine)
+                        finish_session(session)
+                except Exception as e:
+                    print(f"Session {session.session_id} crashed: {e}")
+                    physics_engine.stop()
+                    batch.remove_race(physics_engine)
+                    finish_session(session)
+                session.record_tick((time.perf_counter() - tick_start) / max(len(races), 1))
             socketio.sleep(0.033)
-
-        remove_session(session_id)
-        socketio.emit("session_closed", {"session_id": session_id}, to=session_id)
-        print(f"Session cleaned up: {session_id}")
-
-    thread = threading.Thread(target=simulation_loop, daemon=True)
-    thread.start()
-
-    emit("session_started", {"session_id": session_id})
+    except Exception as e:
+        print(f"Race batch crashed: {e}")
+        for session in sessions:
+            finish_session(session)
+    finally:
+        with batch_lock:
+            if batch in race_batches:
+                race_batches.remove(batch)
 
 
 @socketio.on("stop_lottery")
 def handle_stop(data=None):
     if data and "session_id" in data:
         session_id = data["session_id"]
-        engine = get_session(session_id)
-        if engine:
-            engine.stop()
+        session = get_session(session_id)
+        if session:
+            session.engine.stop()
             print(f"Session stopping requested: {session_id}")
     else:
         print("stop_lottery called without session_id, ignoring")
@@ -153,443 +602,33 @@ def handle_stop(data=None):
 
 @socketio.on("disconnect")
 def handle_disconnect():
+    client_formats.pop(request.sid, None)
+    viewers.leave_all(request.sid)
     print("Client disconnected (session kept alive)")
 
 
-HTML_TEMPLATE = """
-<!DOCTYPE html>
-<html lang="ko">
-<head>
-  <meta charset="UTF-8">
-  <meta name="viewport" content="width=device-width, initial-scale=1.0">
-  <title>Pinball Lottery</title>
-  <style>
-    * { margin: 0; padding: 0; box-sizing: border-box; }
-    body { background: #000; overflow: hidden; font-family: sans-serif; }
-    #canvas { display: block; }
-
-    .winner-display {
-      position: fixed;
-      bottom: 20px;
-      right: 20px;
-      background: rgba(0,0,0,0.9);
-      padding: 25px;
-      border-radius: 12px;
-      border: 3px solid cyan;
-      min-width: 280px;
-      max-width: 320px;
-      max-height: 500px;
-      overflow-y: auto;
-      display: none;
-    }
-    .winner-display.show { display: block; }
-
-    .time-accelerate-notice {
-      background: rgba(255, 200, 0, 0.95);
-      color: #000;
-      padding: 10px 16px;
-      border-radius: 8px;
-      font-size: 14px;
-      font-weight: bold;
-      text-align: center;
-      margin-bottom: 15px;
-      display: none;
-      animation: pulse 1.5s infinite;
-    }
-
-    @keyframes pulse {
-      0%, 100% { opacity: 1; }
-      50% { opacity: 0.7; }
-    }
-
-    .winner-display h3 { color: cyan; margin-bottom: 15px; font-size: 22px; text-align: center; }
-    .winner-item {
-      padding: 8px;
-      margin: 8px 0;
-      background: gold;
-      color: #000;
-      border-radius: 6px;
-      font-size: 13px;
-      font-weight: bold;
-      text-align: center;
-      word-break: break-word;
-      line-height: 1.3;
-    }
-    .winner-item-lost {
-      padding: 8px;
-      margin: 8px 0;
-      background: rgba(100, 100, 100, 0.5);
-      color: #ccc;
-      border-radius: 6px;
-      font-size: 13px;
-      font-weight: bold;
-      text-align: center;
-      word-break: break-word;
-      line-height: 1.3;
-    }
-
-    @media (max-width: 768px) {
-      .winner-display {
-        top: 5px;
-        right: 5px;
-        bottom: auto;
-        max-width: 150px;
-        min-width: 150px;
-        max-height: 35vh;
-        padding: 8px;
-        background: rgba(0,0,0,0.7);
-        border-width: 2px;
-      }
-
-      .winner-display h3 {
-        font-size: 14px;
-        margin-bottom: 5px;
-      }
-
-      .winner-item, .winner-item-lost {
-        font-size: 10px;
-        padding: 5px;
-        margin: 3px 0;
-        line-height: 1.2;
-      }
-
-      .time-accelerate-notice {
-        font-size: 10px;
-        padding: 5px 8px;
-        margin-bottom: 5px;
-      }
-    }
-  </style>
-  <script src="https://cdn.socket.io/4.5.4/socket.io.min.js"></script>
-</head>
-<body>
-  <canvas id="canvas"></canvas>
-  <div class="winner-display" id="winner-display">
-    <div class="time-accelerate-notice" id="time-notice">1 minute elapsed, speeding up</div>
-    <h3>Ranking</h3>
-    <div id="winner-list"></div>
-  </div>
-
-  <script>
-    const canvas = document.getElementById('canvas');
-    const ctx = canvas.getContext('2d');
-
-    canvas.width = window.innerWidth;
-    canvas.height = window.innerHeight;
-
-    window.addEventListener('resize', () => {
-      canvas.width = window.innerWidth;
-      canvas.height = window.innerHeight;
-    });
-
-    const socket = io();
-
-    let camera = {
-      x: 16,
-      y: 20,
-      zoom: 10,
-      targetY: 20,
-      targetZoom: 10
-    };
-
-    let winners = [];
-    let totalMarbles = 0;
-    let winningRank = 0;
-    let particles = [];
-    let elapsedTime = 0;
-    let lotteryFinished = false;
-    let winnerMarble = null;
-    let winnerStartIndex = -1;
-    let currentSessionId = '{{ session_id }}' || null;
-    let stopRequested = false;
-
-    class Particle {
-      constructor(x, y) {
-        this.x = x;
-        this.y = y;
-        this.elapsed = 0;
-        this.lifetime = 3000;
-
-        const force = Math.random() * 250;
-        const ang = (Math.random() * 90 - 180) * Math.PI / 180;
-        this.fx = Math.cos(ang) * force;
-        this.fy = Math.sin(ang) * force;
-        this.hue = Math.random() * 360;
-        this.isDestroy = false;
-      }
-
-      update(deltaTime) {
-        this.elapsed += deltaTime;
-        this.x += this.fx * (deltaTime / 100);
-        this.y += this.fy * (deltaTime / 100);
-        this.fy += (10 * deltaTime) / 100;
-
-        if (this.elapsed > this.lifetime) {
-          this.isDestroy = true;
-        }
-      }
-
-      getAlpha() {
-        return 1 - Math.pow(this.elapsed / this.lifetime, 2);
-      }
-    }
-
-    socket.on('connected', () => {
-      const urlParams = new URLSearchParams(window.location.search);
-      const namesParam = urlParams.get('names');
-      const rankParam = urlParams.get('rank');
-      const sessionParam = urlParams.get('session_id');
-
-      if (sessionParam) {
-        currentSessionId = sessionParam;
-        socket.emit('join', { session_id: currentSessionId });
-        socket.emit('rejoin_session', { session_id: currentSessionId });
-      }
-
-      if (namesParam) {
-        const names = namesParam.split(',').map((n) => n.trim()).filter((n) => n);
-        totalMarbles = names.length;
-        winningRank = rankParam ? parseInt(rankParam, 10) : 1;
-        socket.emit('start_lottery', {
-          names,
-          session_id: currentSessionId
-        });
-      }
-    });
-
-    socket.on('session_started', (data) => {
-      currentSessionId = data.session_id;
-    });
-
-    socket.on('session_closed', () => {
-      stopRequested = true;
-    });
-
-    socket.on('physics_update', (state) => {
-      if (state.elapsed_time !== undefined) {
-        elapsedTime = state.elapsed_time;
-        const timeNotice = document.getElementById('time-notice');
-        timeNotice.style.display = elapsedTime > 60 && !lotteryFinished ? 'block' : 'none';
-      }
-
-      if (state.camera) {
-        camera.targetY = state.camera.targetY;
-        camera.y += (camera.targetY - camera.y) * 0.05;
-
-        if (state.camera.targetZoom) {
-          camera.targetZoom = state.camera.targetZoom;
-          camera.zoom += (camera.targetZoom - camera.zoom) * 0.05;
-        }
-      }
-
-      if (state.winners && state.winners.length > winners.length) {
-        winners = state.winners;
-      }
-
-      if (state.total_marbles) {
-        totalMarbles = state.total_marbles;
-      }
-
-      const remainingMarbles = totalMarbles - winners.length;
-
-      if (winnerStartIndex === -1 && remainingMarbles === winningRank) {
-        winnerStartIndex = winners.length;
-      }
-
-      if (!lotteryFinished && remainingMarbles === 1 && state.marbles && state.marbles.length > 0) {
-        lotteryFinished = true;
-        winnerMarble = state.marbles[0];
-
-        const finalWinners = [];
-        for (let i = winnerStartIndex; i < winners.length; i++) {
-          finalWinners.push(winners[i].name);
-        }
-        finalWinners.push(winnerMarble.name);
-        finalWinners.reverse();
-
-        if (window.parent !== window) {
-          window.parent.postMessage({
-            type: 'PINBALL_WINNERS',
-            winners: finalWinners
-          }, '*');
-        }
-
-        for (let i = 0; i < 200; i++) {
-          particles.push(new Particle(canvas.width / 2, canvas.height / 2));
-        }
-
-        if (!stopRequested) {
-          stopRequested = true;
-          setTimeout(() => {
-            socket.emit('stop_lottery', { session_id: currentSessionId });
-          }, 3000);
-        }
-      }
-
-      updateWinnerDisplay();
-      render(state);
-    });
-
-    function animate() {
-      particles.forEach((p) => p.update(16));
-      particles = particles.filter((p) => !p.isDestroy);
-      requestAnimationFrame(animate);
-    }
-    animate();
-
-    function updateWinnerDisplay() {
-      const list = document.getElementById('winner-list');
-      list.innerHTML = '';
-
-      if (lotteryFinished && winnerMarble) {
-        const div = document.createElement('div');
-        div.className = 'winner-item';
-        div.textContent = '1st ' + winnerMarble.name;
-        list.appendChild(div);
-      }
-
-      for (let i = winners.length - 1; i >= 0; i--) {
-        const winner = winners[i];
-        const rank = totalMarbles - i;
-        const div = document.createElement('div');
-
-        if (winnerStartIndex !== -1 && i >= winnerStartIndex) {
-          div.className = 'winner-item';
-          const winnerRank = winningRank - (i - winnerStartIndex);
-          div.textContent = winnerRank + 'th ' + winner.name;
-        } else {
-          div.className = 'winner-item-lost';
-          div.textContent = rank + 'th ' + winner.name;
-        }
-
-        list.appendChild(div);
-      }
-
-      if (winners.length > 0 || lotteryFinished) {
-        document.getElementById('winner-display').classList.add('show');
-      }
-    }
-
-    function render(state) {
-      ctx.fillStyle = '#000';
-      ctx.fillRect(0, 0, canvas.width, canvas.height);
-
-      if (lotteryFinished && winnerMarble) {
-        camera.targetY = winnerMarble.y;
-        camera.targetZoom = 35;
-      }
-
-      ctx.save();
-      ctx.translate(canvas.width / 2, canvas.height / 2);
-      ctx.scale(camera.zoom, camera.zoom);
-      ctx.translate(-camera.x, -camera.y);
-
-      if (state.walls) {
-        ctx.strokeStyle = 'white';
-        ctx.lineWidth = 0.2;
-        ctx.shadowBlur = 5;
-        ctx.shadowColor = 'white';
-
-        state.walls.forEach((wall) => {
-          ctx.beginPath();
-          ctx.moveTo(wall[0][0], wall[0][1]);
-          for (let i = 1; i < wall.length; i++) {
-            ctx.lineTo(wall[i][0], wall[i][1]);
-          }
-          ctx.stroke();
-        });
-        ctx.shadowBlur = 0;
-      }
-
-      if (state.pins) {
-        ctx.fillStyle = 'cyan';
-        ctx.shadowBlur = 5;
-        ctx.shadowColor = 'cyan';
-
-        state.pins.forEach((pin) => {
-          ctx.save();
-          ctx.translate(pin.x, pin.y);
-          ctx.rotate(pin.angle);
-          ctx.fillRect(-pin.width, -pin.height, pin.width * 2, pin.height * 2);
-          ctx.restore();
-        });
-        ctx.shadowBlur = 0;
-      }
-
-      if (state.boxes) {
-        ctx.fillStyle = 'cyan';
-        ctx.shadowBlur = 5;
-        ctx.shadowColor = 'cyan';
-
-        state.boxes.forEach((box) => {
-          ctx.save();
-          ctx.translate(box.x, box.y);
-          ctx.rotate(box.angle);
-          ctx.fillRect(-box.width, -box.height, box.width * 2, box.height * 2);
-          ctx.restore();
-        });
-        ctx.shadowBlur = 0;
-      }
-
-      if (state.skill_effects) {
-        state.skill_effects.forEach((effect) => {
-          ctx.save();
-          ctx.globalAlpha = effect.alpha;
-          ctx.strokeStyle = 'white';
-          ctx.lineWidth = 1 / camera.zoom;
-          ctx.beginPath();
-          ctx.arc(effect.x, effect.y, effect.size, 0, Math.PI * 2);
-          ctx.stroke();
-          ctx.restore();
-        });
-      }
-
-      if (state.marbles) {
-        state.marbles.forEach((marble) => {
-          ctx.save();
-          ctx.translate(marble.x, marble.y);
-          ctx.rotate(marble.angle);
-
-          ctx.fillStyle = 'hsl(' + marble.hue + ', 100%, 70%)';
-          ctx.shadowBlur = 10;
-          ctx.shadowColor = 'hsl(' + marble.hue + ', 100%, 70%)';
-          ctx.beginPath();
-          ctx.arc(0, 0, 0.25, 0, Math.PI * 2);
-          ctx.fill();
-          ctx.shadowBlur = 0;
-
-          ctx.rotate(-marble.angle);
-          ctx.scale(1 / camera.zoom, 1 / camera.zoom);
-          ctx.fillStyle = '#fff';
-          ctx.font = 'bold 12px sans-serif';
-          ctx.textAlign = 'center';
-          ctx.strokeStyle = '#000';
-          ctx.lineWidth = 3;
-          ctx.strokeText(marble.name, 0, 20);
-          ctx.fillText(marble.name, 0, 20);
-
-          ctx.restore();
-        });
-      }
-
-      ctx.restore();
-
-      particles.forEach((particle) => {
-        ctx.save();
-        ctx.globalAlpha = particle.getAlpha();
-        ctx.fillStyle = 'hsl(' + particle.hue + ', 50%, 50%)';
-        ctx.fillRect(particle.x, particle.y, 20, 20);
-        ctx.restore();
-      });
-    }
-  </script>
-</body>
-</html>
-"""
 
+def start_server():
+    # Process-wide services live here rather than at import time, because
+    # tournament heat workers import this module too and must not bind the
+    # relay port or start reapers and encoder threads of their own.
+    global client_assets, relay_publisher, encoder_pool
+    client_assets = ClientAssets()
+    load_track()
+    if RELAY_PUBLISH:
+        relay_publisher = RelayPublisher(
+            parse_address(RELAY_PUBLISH), get_authkey(), latest_payload=latest_payload
+        )
+    session_manager.start_reaper(socketio.start_background_task, socketio.sleep)
+    if ENCODER_WORKERS > 0:
+        encoder_pool = EncoderPool(ENCODER_WORKERS, socketio.start_background_task)
+    return app
 
-if __name__ == "__main__":
-    import os
 
+if __name__ == "__main__":
+    start_server()
     port = int(os.environ.get("PORT", 5000))
-    socketio.run(app, host="0.0.0.0", port=port, debug=False, allow_unsafe_werkzeug=True)
+    try:
+        socketio.run(app, host="0.0.0.0", port=port, debug=False, allow_unsafe_werkzeug=True)
+    finally:
+        shutdown_executor()
@@ -0,0 +1,38 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import frame_codecs
+from physics_engine import PhysicsEngine
+
+
+def collect_states(marble_count, frames):
+    engine = PhysicsEngine([f"player{i}" for i in range(marble_count)])
+    engine.start()
+    return [engine.update() for _ in range(frames)]
+
+
+def bench(marble_count, frames):
+    states = collect_states(marble_count, frames)
+    print(f"{marble_count} marbles, {frames} frames")
+    for name in frame_codecs.codecs:
+        start = time.perf_counter()
+        total = sum(len(frame_codecs.encode(name, state)) for state in states)
+        elapsed = time.perf_counter() - start
+        print(
+            f"  {name:8s} {total / frames:10.0f} bytes/frame"
+            f" {elapsed / frames * 1e6:10.1f} us/frame"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare frame codecs")
+    parser.add_argument("--marbles", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--frames", type=int, default=300)
+    args = parser.parse_args()
+
+    for count in args.marbles:
+        bench(count, args.frames)
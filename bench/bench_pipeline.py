@@ -0,0 +1,88 @@
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from encoder_pool import EncoderPool
+from frames import Frame
+from physics_engine import PhysicsEngine
+
+FORMATS = ["json", "deflate"]
+TICK = 0.033
+
+
+def start_thread(target):
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def encode_frame(frame):
+    for fmt in FORMATS:
+        frame.encode(fmt)
+
+
+def run(marble_count, ticks, pool, tick_interval):
+    engine = PhysicsEngine([f"player{i}" for i in range(marble_count)])
+    engine.start()
+
+    # Like simulation_loop, each tick is followed by a sleep, which is
+    # where the encoder pool gets to run on a machine with few cores.
+    tick_total = 0.0
+    start = time.perf_counter()
+    for tick in range(ticks):
+        tick_start = time.perf_counter()
+        frame = Frame(tick, engine.update())
+        if pool:
+            pool.submit("bench", lambda frame=frame: encode_frame(frame))
+        else:
+            encode_frame(frame)
+        tick_total += time.perf_counter() - tick_start
+        time.sleep(tick_interval)
+    if pool:
+        pool.wait_idle("bench")
+    wall = time.perf_counter() - start
+    return tick_total / ticks * 1000, wall
+
+
+def breakdown(marble_count, ticks):
+    engine = PhysicsEngine([f"player{i}" for i in range(marble_count)])
+    engine.start()
+    totals = {"step": 0.0, "state": 0.0, "encode": 0.0}
+    for tick in range(ticks):
+        t0 = time.perf_counter()
+        engine.step()
+        t1 = time.perf_counter()
+        frame = Frame(tick, engine.get_state())
+        t2 = time.perf_counter()
+        encode_frame(frame)
+        t3 = time.perf_counter()
+        totals["step"] += t1 - t0
+        totals["state"] += t2 - t1
+        totals["encode"] += t3 - t2
+    return {k: v / ticks * 1000 for k, v in totals.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare inline and pipelined frame encoding")
+    parser.add_argument("--marbles", type=int, nargs="+", default=[100, 1000, 2000])
+    parser.add_argument("--ticks", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--tick-interval", type=float, default=TICK, help="sleep after each tick (0 = back to back)")
+    args = parser.parse_args()
+
+    pool = EncoderPool(args.workers, start_thread)
+    for count in args.marbles:
+        parts = breakdown(count, min(args.ticks, 100))
+        inline_ms, inline_wall = run(count, args.ticks, None, args.tick_interval)
+        dropped_before = pool.dropped
+        piped_ms, piped_wall = run(count, args.ticks, pool, args.tick_interval)
+        print(
+            f"{count:5d} marbles: step {parts['step']:6.2f} state {parts['state']:5.2f}"
+            f" encode {parts['encode']:5.2f} ms | inline {inline_ms:6.2f} ms/tick ({inline_wall:5.2f}s)"
+            f"  pipelined {piped_ms:6.2f} ms/tick ({piped_wall:5.2f}s,"
+            f" {pool.dropped - dropped_before} stale frames dropped)"
+        )
@@ -0,0 +1,119 @@
+import sys
+
+if "--child" in sys.argv and sys.argv[sys.argv.index("--child") + 1] == "eventlet":
+    import eventlet
+
+    eventlet.monkey_patch()
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import frame_codecs
+from physics_engine import PhysicsEngine
+from session_manager import read_rss_bytes
+
+TICK = 0.033
+MODES = ["threading", "eventlet"]
+
+
+def read_os_threads():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("Threads:"):
+                return int(line.split()[1])
+    return None
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_child(sessions, marbles, duration):
+    baseline_rss = read_rss_bytes()
+    lags = []
+    ticks = [0]
+    lock = threading.Lock()
+
+    # Engines are built up front: at 1,000 sessions construction alone can
+    # outlast the run, and the clock should only cover steady-state ticks.
+    engines = [PhysicsEngine([f"s{index}m{i}" for i in range(marbles)]) for index in range(sessions)]
+    # Starting a thread waits for it to run once, which with hundreds of
+    # busy threads takes longer than the run itself, so every worker waits
+    # here until all of them exist.
+    go = threading.Event()
+    deadline = [0.0]
+
+    def simulation_loop(index):
+        go.wait()
+        engine = engines[index]
+        engine.start()
+        while time.time() < deadline[0]:
+            frame_codecs.encode("json", engine.update())
+            start = time.perf_counter()
+            time.sleep(TICK)
+            lag = time.perf_counter() - start - TICK
+            with lock:
+                lags.append(lag)
+                ticks[0] += 1
+
+    workers = [threading.Thread(target=simulation_loop, args=(i,), daemon=True) for i in range(sessions)]
+    for worker in workers:
+        worker.start()
+    deadline[0] = time.time() + duration
+    go.set()
+    time.sleep(duration / 2)
+    os_threads = read_os_threads()
+    rss = read_rss_bytes()
+    for worker in workers:
+        worker.join()
+
+    return {
+        "os_threads": os_threads,
+        "rss_per_session_kb": (rss - baseline_rss) / sessions / 1024,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "ticks_per_second": ticks[0] / duration,
+        "lag_p50_ms": percentile(lags, 0.5) * 1000,
+        "lag_p99_ms": percentile(lags, 0.99) * 1000,
+    }
+
+
+def run_parent(args):
+    print(f"{args.sessions} sessions x {args.marbles} marbles, {args.duration}s per mode")
+    columns = ["os_threads", "rss_per_session_kb", "peak_rss_mb", "ticks_per_second", "lag_p50_ms", "lag_p99_ms"]
+    print("mode       " + " ".join(f"{c:>18s}" for c in columns))
+    for mode in MODES:
+        output = subprocess.run(
+            [
+                sys.executable, __file__, "--child", mode,
+                "--sessions", str(args.sessions),
+                "--marbles", str(args.marbles),
+                "--duration", str(args.duration),
+            ],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:10s} " + " ".join(f"{result[c]:18.1f}" for c in columns))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare threading and eventlet runtime modes at equal load")
+    parser.add_argument("--child", choices=MODES)
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--marbles", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=20)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.sessions, args.marbles, args.duration)))
+    else:
+        run_parent(args)
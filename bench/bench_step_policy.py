@@ -0,0 +1,76 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from physics_engine import PhysicsEngine
+from step_policy import AdaptiveStepPolicy, FixedStepPolicy
+
+FRAME_SECONDS = 0.033
+MAX_FRAMES = 60 * 60 * 30
+
+POLICIES = {
+    "fixed": FixedStepPolicy,
+    "adaptive": AdaptiveStepPolicy,
+}
+
+
+class FrameClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def run_race(policy_name, marble_count, seed, min_iterations):
+    random.seed(seed)
+    clock = FrameClock()
+    policy = POLICIES[policy_name]()
+    if min_iterations is not None and hasattr(policy, "min_iterations"):
+        policy.min_iterations = min_iterations
+    engine = PhysicsEngine(
+        [f"player{i}" for i in range(marble_count)],
+        step_policy=policy,
+        clock=clock,
+    )
+    engine.start()
+
+    # The lottery is decided once a single marble is left on the track.
+    frames = 0
+    iterations = 0
+    start = time.process_time()
+    while engine.is_running and engine.active_count > 1 and frames < MAX_FRAMES:
+        engine.step()
+        iterations += engine.space.iterations
+        clock.now += FRAME_SECONDS
+        frames += 1
+    cpu = time.process_time() - start
+    return frames, cpu, iterations / max(frames, 1)
+
+
+def bench(marble_count, races, min_iterations=None):
+    print(f"{marble_count} marbles, {races} races per policy")
+    for name in POLICIES:
+        results = [run_race(name, marble_count, seed, min_iterations) for seed in range(races)]
+        frames = sum(r[0] for r in results) / races
+        cpu = sum(r[1] for r in results) / races
+        iterations = sum(r[2] for r in results) / races
+        print(
+            f"  {name:8s} race {frames * FRAME_SECONDS:7.1f}s"
+            f"  cpu {cpu:6.2f}s/race  iterations {iterations:4.1f}/frame"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare step policies on headless races")
+    parser.add_argument("--marbles", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--races", type=int, default=5)
+    parser.add_argument("--min-iterations", type=int, help="override the adaptive iteration floor")
+    args = parser.parse_args()
+
+    for count in args.marbles:
+        bench(count, args.races, args.min_iterations)
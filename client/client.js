@@ -0,0 +1,525 @@
+const canvas = document.getElementById('canvas');
+const ctx = canvas.getContext('2d');
+
+canvas.width = window.innerWidth;
+canvas.height = window.innerHeight;
+
+window.addEventListener('resize', () => {
+  canvas.width = window.innerWidth;
+  canvas.height = window.innerHeight;
+});
+
+const supportedFormats = ['json'];
+if (window.MessagePack) {
+  supportedFormats.unshift('msgpack');
+}
+if (window.DecompressionStream) {
+  supportedFormats.unshift('deflate');
+}
+
+const socket = io({ auth: { formats: supportedFormats } });
+let frameFormat = 'json';
+let frameQueue = Promise.resolve();
+
+let camera = {
+  x: 16,
+  y: 20,
+  zoom: 10,
+  targetY: 20,
+  targetZoom: 10
+};
+
+let winners = [];
+let totalMarbles = 0;
+let winningRank = 0;
+let particles = [];
+let elapsedTime = 0;
+let lotteryFinished = false;
+let winnerMarble = null;
+let winnerStartIndex = -1;
+let currentSessionId = new URLSearchParams(window.location.search).get('session_id') || null;
+let stopRequested = false;
+let replaying = false;
+let replayState = null;
+
+class Particle {
+  constructor(x, y) {
+    this.x = x;
+    this.y = y;
+    this.elapsed = 0;
+    this.lifetime = 3000;
+
+    const force = Math.random() * 250;
+    const ang = (Math.random() * 90 - 180) * Math.PI / 180;
+    this.fx = Math.cos(ang) * force;
+    this.fy = Math.sin(ang) * force;
+    this.hue = Math.random() * 360;
+    this.isDestroy = false;
+  }
+
+  update(deltaTime) {
+    this.elapsed += deltaTime;
+    this.x += this.fx * (deltaTime / 100);
+    this.y += this.fy * (deltaTime / 100);
+    this.fy += (10 * deltaTime) / 100;
+
+    if (this.elapsed > this.lifetime) {
+      this.isDestroy = true;
+    }
+  }
+
+  getAlpha() {
+    return 1 - Math.pow(this.elapsed / this.lifetime, 2);
+  }
+}
+
+socket.on('connected', (data) => {
+  frameFormat = (data && data.format) || 'json';
+  const urlParams = new URLSearchParams(window.location.search);
+  const namesParam = urlParams.get('names');
+  const rankParam = urlParams.get('rank');
+  const sessionParam = urlParams.get('session_id');
+  const replayParam = urlParams.get('replay');
+
+  if (sessionParam && replayParam !== null) {
+    currentSessionId = sessionParam;
+    replaying = true;
+    stopRequested = true;
+    socket.emit('join', { session_id: currentSessionId });
+    socket.emit('replay', { session_id: currentSessionId, t: parseFloat(replayParam) || 0 });
+    return;
+  }
+
+  if (sessionParam) {
+    currentSessionId = sessionParam;
+    socket.emit('join', { session_id: currentSessionId });
+    socket.emit('rejoin_session', { session_id: currentSessionId });
+  }
+
+  if (namesParam) {
+    const names = namesParam.split(',').map((n) => n.trim()).filter((n) => n);
+    totalMarbles = names.length;
+    winningRank = rankParam ? parseInt(rankParam, 10) : 1;
+    socket.emit('start_lottery', {
+      names,
+      rank: winningRank,
+      track: urlParams.get('track') || undefined,
+      session_id: currentSessionId
+    });
+  }
+});
+
+socket.on('session_started', (data) => {
+  currentSessionId = data.session_id;
+});
+
+socket.on('session_closed', () => {
+  stopRequested = true;
+});
+
+function decodeFrame(payload) {
+  if (typeof payload === 'string') {
+    return Promise.resolve(JSON.parse(payload));
+  }
+  if (frameFormat === 'msgpack') {
+    return Promise.resolve(MessagePack.decode(new Uint8Array(payload)));
+  }
+  const stream = new Blob([payload]).stream().pipeThrough(new DecompressionStream('deflate'));
+  return new Response(stream).text().then(JSON.parse);
+}
+
+const REPLAY_DELTA_FIELDS = ['gone', 'm', 'b', 'w', 'p', 's'];
+
+function applyReplayDelta(state, delta) {
+  const next = Object.assign({}, state);
+  let marbles = state.marbles;
+  if (delta.gone) {
+    const gone = new Set(delta.gone);
+    marbles = marbles.filter((_, i) => !gone.has(i));
+  }
+  if (delta.m) {
+    marbles = marbles.slice();
+    for (const [i, x, y, angle] of delta.m) {
+      marbles[i] = Object.assign({}, marbles[i], { x, y, angle });
+    }
+  }
+  next.marbles = marbles;
+  if (delta.b) {
+    next.boxes = state.boxes.slice();
+    for (const [i, x, y, angle] of delta.b) {
+      next.boxes[i] = Object.assign({}, next.boxes[i], { x, y, angle });
+    }
+  }
+  if (delta.w) {
+    next.winners = state.winners.concat(delta.w);
+  }
+  if (delta.p) {
+    next.particles = delta.p.map(([x, y, hue, alpha]) => ({ x, y, hue, alpha }));
+  }
+  if (delta.s) {
+    next.skill_effects = delta.s.map(([x, y, size, alpha]) => ({ x, y, size, alpha }));
+  }
+  for (const key of Object.keys(delta)) {
+    if (!REPLAY_DELTA_FIELDS.includes(key)) {
+      next[key] = delta[key];
+    }
+  }
+  return next;
+}
+
+socket.on('replay_frame', (frame) => {
+  const data = JSON.parse(frame.payload);
+  if (frame.delta && !replayState) {
+    return;
+  }
+  replayState = frame.delta ? applyReplayDelta(replayState, data) : data;
+  handleState(replayState);
+});
+
+socket.on('replay_end', () => {
+  replaying = false;
+});
+
+socket.on('physics_update', (payload) => {
+  if (replaying) {
+    return;
+  }
+  frameQueue = frameQueue
+    .then(() => decodeFrame(payload))
+    .then(handleState)
+    .catch((err) => console.error('Failed to decode frame', err));
+});
+
+let track = null;
+let trackHash = null;
+
+function loadTrack(hash) {
+  if (trackHash === hash) {
+    return;
+  }
+  trackHash = hash;
+
+  const cacheKey = 'track:' + hash;
+  try {
+    const cached = window.localStorage.getItem(cacheKey);
+    if (cached) {
+      track = JSON.parse(cached);
+      return;
+    }
+  } catch (err) {}
+
+  track = null;
+  fetch('/tracks/' + hash)
+    .then((res) => res.json())
+    .then((data) => {
+      if (trackHash !== hash) {
+        return;
+      }
+      track = data;
+      try {
+        window.localStorage.setItem(cacheKey, JSON.stringify(data));
+      } catch (err) {}
+    })
+    .catch(() => {
+      trackHash = null;
+    });
+}
+
+function handleState(state) {
+  if (state.track) {
+    loadTrack(state.track);
+  }
+
+  if (state.elapsed_time !== undefined) {
+    elapsedTime = state.elapsed_time;
+    const timeNotice = document.getElementById('time-notice');
+    timeNotice.style.display = elapsedTime > 60 && !lotteryFinished ? 'block' : 'none';
+  }
+
+  if (state.camera) {
+    camera.targetY = state.camera.targetY;
+    camera.y += (camera.targetY - camera.y) * 0.05;
+
+    if (state.camera.targetZoom) {
+      camera.targetZoom = state.camera.targetZoom;
+      camera.zoom += (camera.targetZoom - camera.zoom) * 0.05;
+    }
+  }
+
+  if (state.winners && state.winners.length > winners.length) {
+    winners = state.winners;
+  }
+
+  if (state.total_marbles) {
+    totalMarbles = state.total_marbles;
+  }
+
+  const remainingMarbles = totalMarbles - winners.length;
+
+  if (winnerStartIndex === -1 && remainingMarbles === winningRank) {
+    winnerStartIndex = winners.length;
+  }
+
+  if (!lotteryFinished && remainingMarbles === 1 && state.marbles && state.marbles.length > 0) {
+    lotteryFinished = true;
+    winnerMarble = state.marbles[0];
+
+    const finalWinners = [];
+    for (let i = winnerStartIndex; i < winners.length; i++) {
+      finalWinners.push(winners[i].name);
+    }
+    finalWinners.push(winnerMarble.name);
+    finalWinners.reverse();
+
+    if (window.parent !== window) {
+      window.parent.postMessage({
+        type: 'PINBALL_WINNERS',
+        winners: finalWinners
+      }, '*');
+    }
+
+    for (let i = 0; i < 200; i++) {
+      particles.push(new Particle(canvas.width / 2, canvas.height / 2));
+    }
+
+    if (!stopRequested) {
+      stopRequested = true;
+      setTimeout(() => {
+        socket.emit('stop_lottery', { session_id: currentSessionId });
+      }, 3000);
+    }
+  }
+
+  updateWinnerDisplay();
+  render(state);
+}
+
+function animate() {
+  particles.forEach((p) => p.update(16));
+  particles = particles.filter((p) => !p.isDestroy);
+  requestAnimationFrame(animate);
+}
+animate();
+
+const MARBLE_GLOW_LIMIT = 60;
+const STATIC_LAYER_MAX_SCALE_DRIFT = 0.02;
+
+const staticLayer = document.createElement('canvas');
+const staticCtx = staticLayer.getContext('2d');
+let staticView = null;
+
+let rankingKey = null;
+let renderedWinners = 0;
+let finishedRow = null;
+
+function createRankingRow(className, text) {
+  const div = document.createElement('div');
+  div.className = className;
+  div.textContent = text;
+  return div;
+}
+
+function updateWinnerDisplay() {
+  const list = document.getElementById('winner-list');
+  const key = [winnerStartIndex, winningRank, totalMarbles, lotteryFinished].join(':');
+
+  if (key !== rankingKey || winners.length < renderedWinners) {
+    list.textContent = '';
+    rankingKey = key;
+    renderedWinners = 0;
+    finishedRow = null;
+
+    if (lotteryFinished && winnerMarble) {
+      finishedRow = createRankingRow('winner-item', '1st ' + winnerMarble.name);
+      list.appendChild(finishedRow);
+    }
+  }
+
+  for (let i = renderedWinners; i < winners.length; i++) {
+    const winner = winners[i];
+    let row;
+
+    if (winnerStartIndex !== -1 && i >= winnerStartIndex) {
+      const winnerRank = winningRank - (i - winnerStartIndex);
+      row = createRankingRow('winner-item', winnerRank + 'th ' + winner.name);
+    } else {
+      row = createRankingRow('winner-item-lost', (totalMarbles - i) + 'th ' + winner.name);
+    }
+
+    list.insertBefore(row, finishedRow ? finishedRow.nextSibling : list.firstChild);
+  }
+  renderedWinners = winners.length;
+
+  if (winners.length > 0 || lotteryFinished) {
+    document.getElementById('winner-display').classList.add('show');
+  }
+}
+
+function staticLayerMargin() {
+  return canvas.height / 2;
+}
+
+function staticLayerValid() {
+  if (!staticView || staticView.track !== track) {
+    return false;
+  }
+  if (staticView.width !== canvas.width || staticView.height !== canvas.height) {
+    return false;
+  }
+  if (Math.abs(camera.zoom / staticView.zoom - 1) > STATIC_LAYER_MAX_SCALE_DRIFT) {
+    return false;
+  }
+  return Math.abs((staticView.y - camera.y) * camera.zoom) < staticLayerMargin() * 0.8;
+}
+
+function renderStaticLayer() {
+  const margin = staticLayerMargin();
+  staticLayer.width = canvas.width;
+  staticLayer.height = canvas.height + margin * 2;
+  staticView = {
+    track,
+    y: camera.y,
+    zoom: camera.zoom,
+    width: canvas.width,
+    height: canvas.height
+  };
+
+  staticCtx.save();
+  staticCtx.translate(canvas.width / 2, margin + canvas.height / 2);
+  staticCtx.scale(camera.zoom, camera.zoom);
+  staticCtx.translate(-camera.x, -camera.y);
+
+  staticCtx.strokeStyle = 'white';
+  staticCtx.lineWidth = 0.2;
+  staticCtx.shadowBlur = 5;
+  staticCtx.shadowColor = 'white';
+  staticCtx.beginPath();
+  track.walls.forEach((wall) => {
+    staticCtx.moveTo(wall[0][0], wall[0][1]);
+    for (let i = 1; i < wall.length; i++) {
+      staticCtx.lineTo(wall[i][0], wall[i][1]);
+    }
+  });
+  staticCtx.stroke();
+
+  staticCtx.fillStyle = 'cyan';
+  staticCtx.shadowColor = 'cyan';
+  staticCtx.beginPath();
+  track.pins.forEach((pin) => addBoxPath(staticCtx, pin));
+  staticCtx.fill();
+
+  staticCtx.restore();
+}
+
+function addBoxPath(context, box) {
+  const cos = Math.cos(box.angle);
+  const sin = Math.sin(box.angle);
+  const corners = [
+    [-box.width, -box.height], [box.width, -box.height],
+    [box.width, box.height], [-box.width, box.height]
+  ];
+  corners.forEach(([cx, cy], i) => {
+    const x = box.x + cx * cos - cy * sin;
+    const y = box.y + cx * sin + cy * cos;
+    if (i === 0) {
+      context.moveTo(x, y);
+    } else {
+      context.lineTo(x, y);
+    }
+  });
+  context.closePath();
+}
+
+function drawStaticLayer() {
+  if (!track) {
+    return;
+  }
+  if (!staticLayerValid()) {
+    renderStaticLayer();
+  }
+
+  const scale = camera.zoom / staticView.zoom;
+  ctx.save();
+  ctx.translate(canvas.width / 2, canvas.height / 2 + (staticView.y - camera.y) * camera.zoom);
+  ctx.scale(scale, scale);
+  ctx.drawImage(staticLayer, -canvas.width / 2, -(staticLayerMargin() + canvas.height / 2));
+  ctx.restore();
+}
+
+function render(state) {
+  ctx.fillStyle = '#000';
+  ctx.fillRect(0, 0, canvas.width, canvas.height);
+
+  if (lotteryFinished && winnerMarble) {
+    camera.targetY = winnerMarble.y;
+    camera.targetZoom = 35;
+  }
+
+  drawStaticLayer();
+
+  ctx.save();
+  ctx.translate(canvas.width / 2, canvas.height / 2);
+  ctx.scale(camera.zoom, camera.zoom);
+  ctx.translate(-camera.x, -camera.y);
+
+  if (state.boxes) {
+    ctx.fillStyle = 'cyan';
+    ctx.shadowBlur = 5;
+    ctx.shadowColor = 'cyan';
+    ctx.beginPath();
+    state.boxes.forEach((box) => addBoxPath(ctx, box));
+    ctx.fill();
+    ctx.shadowBlur = 0;
+  }
+
+  if (state.skill_effects) {
+    ctx.strokeStyle = 'white';
+    ctx.lineWidth = 1 / camera.zoom;
+    state.skill_effects.forEach((effect) => {
+      ctx.globalAlpha = effect.alpha;
+      ctx.beginPath();
+      ctx.arc(effect.x, effect.y, effect.size, 0, Math.PI * 2);
+      ctx.stroke();
+    });
+    ctx.globalAlpha = 1;
+  }
+
+  if (state.marbles) {
+    ctx.shadowBlur = state.marbles.length <= MARBLE_GLOW_LIMIT ? 10 : 0;
+    state.marbles.forEach((marble) => {
+      const color = 'hsl(' + marble.hue + ', 100%, 70%)';
+      ctx.fillStyle = color;
+      ctx.shadowColor = color;
+      ctx.beginPath();
+      ctx.arc(marble.x, marble.y, 0.25, 0, Math.PI * 2);
+      ctx.fill();
+    });
+    ctx.shadowBlur = 0;
+  }
+
+  ctx.restore();
+
+  if (state.marbles) {
+    ctx.fillStyle = '#fff';
+    ctx.font = 'bold 12px sans-serif';
+    ctx.textAlign = 'center';
+    ctx.strokeStyle = '#000';
+    ctx.lineWidth = 3;
+    state.marbles.forEach((marble) => {
+      const x = canvas.width / 2 + (marble.x - camera.x) * camera.zoom;
+      const y = canvas.height / 2 + (marble.y - camera.y) * camera.zoom + 20;
+      if (y < -20 || y > canvas.height + 20) {
+        return;
+      }
+      ctx.strokeText(marble.name, x, y);
+      ctx.fillText(marble.name, x, y);
+    });
+  }
+
+  particles.forEach((particle) => {
+    ctx.globalAlpha = particle.getAlpha();
+    ctx.fillStyle = 'hsl(' + particle.hue + ', 50%, 50%)';
+    ctx.fillRect(particle.x, particle.y, 20, 20);
+  });
+  ctx.globalAlpha = 1;
+}
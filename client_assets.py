@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import Response, abort
+
+CLIENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "client")
+ASSET_URL_PREFIX = "/assets/"
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+SHELL_FILE = "index.html"
+ASSET_FILES = {
+    "client_css": "client.css",
+    "client_js": "client.js",
+}
+
+
+class Asset:
+    __slots__ = ("body", "gzip_body", "etag", "mimetype", "cache_control")
+
+    def __init__(self, body, mimetype, cache_control):
+        self.body = body
+        self.gzip_body = gzip.compress(body, compresslevel=9, mtime=0)
+        self.etag = hashlib.sha256(body).hexdigest()[:16]
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+
+
+def hashed_name(filename, body):
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}.{hashlib.sha256(body).hexdigest()[:12]}{ext}"
+
+
+class ClientAssets:
+    def __init__(self, directory=CLIENT_DIR):
+        self.assets = {}
+        urls = {}
+
+        for key, filename in ASSET_FILES.items():
+            with open(os.path.join(directory, filename), "rb") as f:
+                body = f.read()
+            name = hashed_name(filename, body)
+            mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            self.assets[name] = Asset(
+                body, mimetype, f"public, max-age={ASSET_MAX_AGE}, immutable"
+            )
+            urls[key] = ASSET_URL_PREFIX + name
+
+        with open(os.path.join(directory, SHELL_FILE), encoding="utf-8") as f:
+            shell = f.read()
+        for key, url in urls.items():
+            shell = shell.replace("{{ " + key + " }}", url)
+        self.shell = Asset(shell.encode("utf-8"), "text/html", "no-cache")
+        self.tracks = {}
+
+    def serve_shell(self, request):
+        return self.make_response(self.shell, request)
+
+    def serve_asset(self, name, request):
+        asset = self.assets.get(name)
+        if asset is None:
+            abort(404)
+        return self.make_response(asset, request)
+
+    def serve_track(self, track, request):
+        asset = self.tracks.get(track.hash)
+        if asset is None:
+            asset = Asset(
+                track.payload, "application/json",
+                f"public, max-age={ASSET_MAX_AGE}, immutable"
+            )
+            self.tracks[track.hash] = asset
+        return self.make_response(asset, request)
+
+    def make_response(self, asset, request):
+        if request.accept_encodings["gzip"]:
+            response = Response(asset.gzip_body, mimetype=asset.mimetype)
+            response.headers["Content-Encoding"] = "gzip"
+            response.set_etag(asset.etag + "-gz")
+        else:
+            response = Response(asset.body, mimetype=asset.mimetype)
+            response.set_etag(asset.etag)
+        response.headers["Cache-Control"] = asset.cache_control
+        response.headers["Vary"] = "Accept-Encoding"
+        return response.make_conditional(request)
@@ -0,0 +1,71 @@
+import os
+import threading
+from collections import deque
+
+ENCODER_WORKERS = int(os.environ.get("ENCODER_WORKERS", 2))
+
+
+class EncoderPool:
+    def __init__(self, workers, start_task):
+        self.pending = {}
+        self.busy = set()
+        self.running = {}
+        self.ready = deque()
+        self.cond = threading.Condition()
+        self.submitted = 0
+        self.dropped = 0
+
+        for _ in range(workers):
+            start_task(self.worker_loop)
+
+    def submit(self, key, job):
+        # Each key holds at most one pending job. A newer frame replaces a
+        # stale one that no worker has picked up yet, and jobs for the same
+        # key never run concurrently, so frames stay in order.
+        with self.cond:
+            self.submitted += 1
+            if key in self.pending:
+                self.dropped += 1
+            elif key not in self.busy:
+                self.ready.append(key)
+            self.pending[key] = job
+            self.cond.notify()
+
+    def worker_loop(self):
+        task_id = threading.get_ident()
+        while True:
+            with self.cond:
+                while not self.ready:
+                    self.cond.wait()
+                key = self.ready.popleft()
+                job = self.pending.pop(key)
+                self.busy.add(key)
+                self.running[task_id] = key
+
+            try:
+                job()
+            except Exception as e:
+                print(f"Frame encoding failed for {key}: {e}")
+
+            with self.cond:
+                del self.running[task_id]
+                self.busy.discard(key)
+                if key in self.pending:
+                    self.ready.append(key)
+                self.cond.notify_all()
+
+    def is_running(self, task_id, key):
+        # Used by the profiler to attribute encoder work to a session.
+        return self.running.get(task_id) is key
+
+    def wait_idle(self, key):
+        with self.cond:
+            while key in self.pending or key in self.busy:
+                self.cond.wait()
+
+    def get_stats(self):
+        return {
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "queued": len(self.pending),
+        }
@@ -0,0 +1,84 @@
+import json
+import os
+import time
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+DEFAULT_FORMAT = "json"
+COMPRESS_THRESHOLD = int(os.environ.get("FRAME_COMPRESS_THRESHOLD", 1024))
+COMPRESS_LEVEL = 6
+
+
+def encode_json(state):
+    return json.dumps(state, separators=(",", ":"))
+
+
+def encode_msgpack(state):
+    return msgpack.packb(state, use_single_float=True)
+
+
+def encode_deflate(state):
+    text = encode_json(state)
+    if len(text) < COMPRESS_THRESHOLD:
+        return text
+    return zlib.compress(text.encode(), COMPRESS_LEVEL)
+
+
+class Codec:
+    def __init__(self, name, encode_fn):
+        self.name = name
+        self.encode_fn = encode_fn
+        self.frames = 0
+        self.total_bytes = 0
+        self.encode_seconds = 0.0
+
+    def encode(self, state):
+        start = time.perf_counter()
+        payload = self.encode_fn(state)
+        self.encode_seconds += time.perf_counter() - start
+        self.frames += 1
+        self.total_bytes += len(payload)
+        return payload
+
+    def get_stats(self):
+        frames = self.frames or 1
+        return {
+            "frames": self.frames,
+            "bytes_per_frame": self.total_bytes / frames,
+            "encode_us_per_frame": self.encode_seconds / frames * 1e6,
+        }
+
+
+codecs = {
+    "json": Codec("json", encode_json),
+    "deflate": Codec("deflate", encode_deflate),
+}
+if msgpack is not None:
+    codecs["msgpack"] = Codec("msgpack", encode_msgpack)
+
+SERVER_FORMATS = [
+    name
+    for name in os.environ.get("FRAME_FORMATS", DEFAULT_FORMAT).split(",")
+    if name in codecs
+] or [DEFAULT_FORMAT]
+
+
+def negotiate_format(client_formats):
+    if not isinstance(client_formats, (list, tuple)):
+        return DEFAULT_FORMAT
+    for name in SERVER_FORMATS:
+        if name in client_formats:
+            return name
+    return DEFAULT_FORMAT
+
+
+def encode(name, state):
+    return codecs[name].encode(state)
+
+
+def get_stats():
+    return {name: codec.get_stats() for name, codec in codecs.items()}
@@ -0,0 +1,31 @@
+import time
+
+import frame_codecs
+
+
+class Frame:
+    __slots__ = ("tick", "state", "encodings", "created_at")
+
+    def __init__(self, tick, state):
+        self.tick = tick
+        self.state = state
+        self.encodings = {}
+        self.created_at = time.time()
+
+    def encode(self, fmt=frame_codecs.DEFAULT_FORMAT):
+        payload = self.encodings.get(fmt)
+        if payload is None:
+            payload = frame_codecs.encode(fmt, self.state)
+            self.encodings[fmt] = payload
+        return payload
+
+    @property
+    def payload(self):
+        return self.encode(frame_codecs.DEFAULT_FORMAT)
+
+    def encoded_size(self):
+        return sum(len(p) for p in list(self.encodings.values()))
+
+
+def frame_room(session_id, fmt):
+    return f"{session_id}/{fmt}"
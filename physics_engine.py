@@ -3,6 +3,9 @@ import random
 import time
 import math
 
+from step_policy import FixedStepPolicy
+from track import load_track
+
 class Particle:
     def __init__(self, x, y):
         self.x = x
@@ -82,17 +85,26 @@ class SkillEffect:
 
 
 class PhysicsEngine:
-    def __init__(self, names):
-        self.space = pymunk.Space()
-        self.space.gravity = (0, 10)
-        self.space.iterations = 6
-        self.space.sleep_time_threshold = float('inf')
-        
+    SLEEP_TIME_THRESHOLD = 0.5
+    STALL_TIME_THRESHOLD = 3.0
+    # A sleeping marble is resting on something, which is usually fine;
+    # only one that stays asleep this long is treated as stuck.
+    SLEEP_STALL_THRESHOLD = 10.0
+    STALL_SPEED = 0.5
+    
+    def __init__(self, names, allow_sleep=False, track=None, step_policy=None,
+                 clock=time.time, space=None, offset_x=0):
+        self.space = space or self.create_space(allow_sleep)
+        self.offset_x = offset_x
+        self.allow_sleep = allow_sleep
+        self.static_shapes = []
+        
+        self.track = track or load_track()
         self.names = names
         self.marbles = []
         self.winners = []
         self.is_running = False
-        self.GOAL_Y = 111
+        self.GOAL_Y = self.track.goal_y
         self.camera_y = 20
         self.camera_target_y = 20
         self.camera_zoom = 10
@@ -104,73 +116,69 @@ class PhysicsEngine:
         
         self.start_time = None
         self.elapsed_time = 0
+        self.clock = clock
+        
+        self.step_policy = step_policy or FixedStepPolicy()
+        self.sim_time = 0
+        self.last_finish_time = 0
+        self.active_count = len(names)
+        self.pack_progress = 0
+        self.contact_count = 0
+        if self.step_policy.track_contacts:
+            self.track_contacts()
         
         self.create_map()
         self.create_marbles()
     
-    def create_map(self):
-        left_wall_points = [
-            (9.25, -300), (9.25, 8.5), (2, 19.25), (2, 26),
-            (9.75, 30), (9.75, 33.5), (1.25, 41), (1.25, 53.75),
-            (8.25, 58.75), (8.25, 63), (9.25, 64), (8.25, 65),
-            (8.25, 99.25), (15.1, 106.75), (15.1, 111.75)
-        ]
-        self.create_polyline(left_wall_points)
-        
-        right_wall_points = [
-            (16.5, -300), (16.5, 9.25), (9.5, 20), (9.5, 22.5),
-            (17.5, 26), (17.5, 33.5), (24, 38.5), (19, 45.5),
-            (19, 55.5), (24, 59.25), (24, 63), (23, 64),
-            (24, 65), (24, 100.5), (16, 106.75), (16, 111.75)
-        ]
-        self.create_polyline(right_wall_points)
-        
-        inner_zone1_points = [
-            (12.75, 37.5), (7, 43.5), (7, 49.75), (12.75, 53.75), (12.75, 37.5)
-        ]
-        self.create_polyline(inner_zone1_points)
-        
-        inner_zone2_points = [
-            (14.75, 37.5), (14.75, 43), (17.5, 40.25), (14.75, 37.5)
-        ]
-        self.create_polyline(inner_zone2_points)
+    @classmethod
+    def create_space(cls, allow_sleep=False):
+        space = pymunk.Space()
+        space.gravity = (0, 10)
+        space.iterations = 6
+        if allow_sleep:
+            space.sleep_time_threshold = cls.SLEEP_TIME_THRESHOLD
+            space.idle_speed_threshold = cls.STALL_SPEED
+        else:
+            space.sleep_time_threshold = float('inf')
+        return space
+    
+    @property
+    def time_since_finish(self):
+        return self.sim_time - self.last_finish_time
+    
+    def track_contacts(self):
+        handler = self.space.add_default_collision_handler()
         
-        top_pins = [
-            (15.5, 30.0), (15.5, 32), (15.5, 28),
-            (12.5, 30), (12.5, 32), (12.5, 28)
-        ]
-        for x, y in top_pins:
-            self.create_box(x, y, 0.2, 0.2, -math.pi/4, restitution=1)
+        def begin(arbiter, space, data):
+            self.contact_count += 1
+            return True
         
-        diagonal_xs = [9.4, 11.3, 13.2, 15.1, 17, 18.9, 20.7, 22.7]
-        for x in diagonal_xs:
-            self.create_box(x, 66.6, 0.6, 0.1, math.pi/4, restitution=0)
+        def separate(arbiter, space, data):
+            self.contact_count -= 1
         
-        for x in diagonal_xs:
-            self.create_box(x, 69.1, 0.6, 0.1, -math.pi/4, restitution=0)
+        handler.begin = begin
+        handler.separate = separate
+    
+    def create_map(self):
+        self.create_static_map()
         
         self.wheels = []
-        wheel_data = [
-            (8, 75, 3.5), (12, 75, -3.5), (16, 75, 3.5),
-            (20, 75, -3.5), (24, 75, 3.5)
-        ]
-        for x, y, vel in wheel_data:
-            wheel = self.create_rotating_box(x, y, 2, 0.1, vel)
+        for data in self.track.wheels:
+            wheel = self.create_rotating_box(
+                data['x'] + self.offset_x, data['y'], data['width'], data['height'],
+                data['angular_velocity']
+            )
             self.wheels.append(wheel)
-        
-        pin_y92_xs = [9.5, 12.75, 16, 19.25, 22.5]
-        for x in pin_y92_xs:
-            self.create_box(x, 92, 0.25, 0.25, 0.7853981633974483, restitution=0)
-        
-        pin_y95_xs = [11, 14.25, 17.5, 20.75]
-        for x in pin_y95_xs:
-            self.create_box(x, 95, 0.25, 0.25, 0.7853981633974483, restitution=0)
-        
-        for x in pin_y92_xs:
-            self.create_box(x, 98, 0.25, 0.25, 0.7853981633974483, restitution=0)
-        
-        goal_wheel = self.create_rotating_box(14, 106.75, 2, 0.1, -1.2)
-        self.wheels.append(goal_wheel)
+    
+    def create_static_map(self):
+        for wall in self.track.walls:
+            self.create_polyline([(x + self.offset_x, y) for x, y in wall])
+        
+        for pin in self.track.pins:
+            self.create_box(
+                pin['x'] + self.offset_x, pin['y'], pin['width'], pin['height'],
+                pin['angle'], restitution=pin['restitution']
+            )
     
     def create_polyline(self, points):
         body = self.space.static_body
@@ -181,6 +189,7 @@ class PhysicsEngine:
             segment.friction = 0
             segment.elasticity = 0
             self.space.add(segment)
+            self.static_shapes.append(segment)
     
     def create_box(self, x, y, width, height, rotation, restitution=0):
         body = self.space.static_body
@@ -200,6 +209,7 @@ class PhysicsEngine:
         poly.friction = 0
         poly.elasticity = restitution
         self.space.add(poly)
+        self.static_shapes.append(poly)
     
     def create_rotating_box(self, x, y, width, height, angular_velocity):
         moment = pymunk.moment_for_box(1, (width * 2, height * 2))
@@ -215,12 +225,17 @@ class PhysicsEngine:
         poly.elasticity = 0
         
         self.space.add(body, poly)
-        return {'body': body, 'vel': angular_velocity}
+        return {
+            'body': body, 'shape': poly, 'vel': angular_velocity,
+            'width': width, 'height': height
+        }
     
     def create_marbles(self):
+        spawn = self.track.spawn
         for i, name in enumerate(self.names):
-            x = 10.5 + (i % 10) * 0.6
-            y = 5 - (i // 10) * 2
+            row, column = divmod(i, spawn['columns'])
+            x = spawn['x'] + column * spawn['spacing_x'] + self.offset_x
+            y = spawn['y'] - row * spawn['spacing_y']
             hue = (360 / len(self.names)) * i
             
             mass = 1 + random.random()
@@ -244,6 +259,8 @@ class PhysicsEngine:
                 'name': name,
                 'hue': hue,
                 'finished': False,
+                'slow_time': 0,
+                'sleep_time': 0,
                 'cooltime': max_cooltime * random.random(),
                 'max_cooltime': max_cooltime,
                 'skill_rate': skill_rate
@@ -252,13 +269,43 @@ class PhysicsEngine:
     def start(self):
         self.is_running = True
         self.winner_found = False
-        self.start_time = time.time()
+        self.start_time = self.clock()
         for marble in self.marbles:
             marble['body'].activate()
     
     def stop(self):
         self.is_running = False
     
+    def detach(self, space=None):
+        """Move this race into another space, or a private one by default."""
+        bodies = [(m['body'], m['shape']) for m in self.marbles if not m['finished']]
+        bodies += [(w['body'], w['shape']) for w in self.wheels]
+        self.release_static_map()
+        for body, shape in bodies:
+            self.space.remove(body, shape)
+        
+        self.space = space or self.create_space(self.allow_sleep)
+        self.create_static_map()
+        for body, shape in bodies:
+            self.space.add(body, shape)
+        self.contact_count = 0
+        if self.step_policy.track_contacts:
+            self.track_contacts()
+    
+    def release_static_map(self):
+        self.space.remove(*self.static_shapes)
+        self.static_shapes = []
+    
+    def release(self):
+        for marble in self.marbles:
+            if not marble['finished']:
+                self.space.remove(marble['body'], marble['shape'])
+        for wheel in self.wheels:
+            self.space.remove(wheel['body'], wheel['shape'])
+        self.release_static_map()
+        self.marbles = []
+        self.wheels = []
+    
     def apply_impact(self, source_marble):
         src_pos = source_marble['body'].position
         
@@ -279,27 +326,69 @@ class PhysicsEngine:
                     power = 1 - dist / 10
                     force = power * power * 5
                     impulse = (nx * force * 1.5, ny * force * 1.5)
+                    marble['body'].activate()
                     marble['body'].apply_impulse_at_world_point(
                         impulse, 
                         marble['body'].position
                     )
     
+    def check_stall(self, marble, time_step):
+        # Sleeping and slow-but-awake time are counted separately, and each
+        # resets when the other starts. Otherwise a pile that was woken up
+        # keeps its old counts, its marbles get nudged one after another,
+        # and the group never settles long enough to fall asleep again.
+        body = marble['body']
+        if body.is_sleeping:
+            marble['slow_time'] = 0
+            marble['sleep_time'] += time_step
+            if marble['sleep_time'] > self.SLEEP_STALL_THRESHOLD:
+                marble['sleep_time'] = 0
+                self.nudge(body)
+            return
+        
+        marble['sleep_time'] = 0
+        vel = body.velocity
+        if math.sqrt(vel.x**2 + vel.y**2) >= self.STALL_SPEED:
+            marble['slow_time'] = 0
+            return
+        
+        marble['slow_time'] += time_step
+        if marble['slow_time'] > self.STALL_TIME_THRESHOLD:
+            marble['slow_time'] = 0
+            self.nudge(body)
+    
+    def nudge(self, body):
+        body.activate()
+        body.apply_impulse_at_local_point((random.uniform(-0.1, 0.1), 0.1))
+    
     def update(self):
+        self.step()
+        return self.get_state()
+    
+    def step(self):
         if not self.is_running:
-            self.particle_manager.update(10)
-            for effect in self.skill_effects:
-                effect.update(10)
-            self.skill_effects = [e for e in self.skill_effects if not e.is_destroy]
-            return self.get_state()
-        
-        if self.start_time:
-            self.elapsed_time = time.time() - self.start_time
-        
-        time_step = 0.0125
-        if self.elapsed_time > 60:
-            time_step = 0.0155
-        
-        self.space.step(time_step)
+            self.update_effects()
+            return
+        
+        self.update_clock()
+        plan = self.step_policy.plan(self)
+        self.space.iterations = plan.iterations
+        for _ in range(plan.substeps):
+            self.space.step(plan.time_step)
+        self.after_step(plan.time_step * plan.substeps)
+    
+    def update_clock(self):
+        if self.start_time is not None:
+            self.elapsed_time = self.clock() - self.start_time
+    
+    def update_effects(self):
+        self.particle_manager.update(10)
+        for effect in self.skill_effects:
+            effect.update(10)
+        self.skill_effects = [e for e in self.skill_effects if not e.is_destroy]
+    
+    def after_step(self, time_step):
+        self.sim_time += time_step
         
         for wheel in self.wheels:
             wheel['body'].angular_velocity = wheel['vel']
@@ -307,17 +396,20 @@ class PhysicsEngine:
         for marble in self.marbles:
             if not marble['finished']:
                 body = marble['body']
-                vel = body.velocity
-                speed = math.sqrt(vel.x**2 + vel.y**2)
-                if speed < 0.5:
-                    body.apply_impulse_at_local_point((random.uniform(-0.1, 0.1), 0.1))
+                if self.allow_sleep:
+                    self.check_stall(marble, time_step)
+                else:
+                    vel = body.velocity
+                    speed = math.sqrt(vel.x**2 + vel.y**2)
+                    if speed < self.STALL_SPEED:
+                        body.apply_impulse_at_local_point((random.uniform(-0.1, 0.1), 0.1))
                 
                 marble['cooltime'] -= 10
                 
                 if marble['cooltime'] <= 0:
                     if random.random() < marble['skill_rate']:
                         pos = marble['body'].position
-                        self.skill_effects.append(SkillEffect(pos.x, pos.y))
+                        self.skill_effects.append(SkillEffect(pos.x - self.offset_x, pos.y))
                         self.apply_impact(marble)
                     marble['cooltime'] = marble['max_cooltime']
         
@@ -334,96 +426,36 @@ class PhysicsEngine:
                     'name': marble['name'],
                     'hue': marble['hue']
                 })
+                self.last_finish_time = self.sim_time
                 
                 if len(self.winners) == len(self.marbles):
                     self.winner_found = True
                     self.is_running = False
         
-        self.particle_manager.update(10)
-        for effect in self.skill_effects:
-            effect.update(10)
-        self.skill_effects = [e for e in self.skill_effects if not e.is_destroy]
+        self.update_effects()
         
         active_marbles = [m for m in self.marbles if not m['finished']]
+        self.active_count = len(active_marbles)
         if active_marbles:
             lowest_y = max(m['body'].position.y for m in active_marbles)
+            highest_y = min(m['body'].position.y for m in active_marbles)
+            self.pack_progress = max(highest_y, 0) / self.GOAL_Y
             self.camera_target_y = min(lowest_y, self.GOAL_Y - 10)
             
-            if lowest_y < 50:
-                progress = lowest_y / 50.0
-                self.camera_target_zoom = 10 + (progress * 5)
-            elif lowest_y < 90:
-                progress = (lowest_y - 50) / 40.0
-                self.camera_target_zoom = 15 + (progress * 5)
-            else:
-                progress = (lowest_y - 90) / 21.0
-                self.camera_target_zoom = 20 + (progress * 10)
-        
-        return self.get_state()
+            bands = self.track.camera_bands
+            if bands:
+                band = next((b for b in bands if lowest_y < b['until_y']), bands[-1])
+                progress = (lowest_y - band['start_y']) / (band['until_y'] - band['start_y'])
+                self.camera_target_zoom = band['zoom_from'] + progress * (band['zoom_to'] - band['zoom_from'])
     
     def get_state(self):
-        walls = []
-        
-        left_wall = [
-            [9.25, -300], [9.25, 8.5], [2, 19.25], [2, 26],
-            [9.75, 30], [9.75, 33.5], [1.25, 41], [1.25, 53.75],
-            [8.25, 58.75], [8.25, 63], [9.25, 64], [8.25, 65],
-            [8.25, 99.25], [15.1, 106.75], [15.1, 111.75]
-        ]
-        
-        right_wall = [
-            [16.5, -300], [16.5, 9.25], [9.5, 20], [9.5, 22.5],
-            [17.5, 26], [17.5, 33.5], [24, 38.5], [19, 45.5],
-            [19, 55.5], [24, 59.25], [24, 63], [23, 64],
-            [24, 65], [24, 100.5], [16, 106.75], [16, 111.75]
-        ]
-        
-        inner_zone1 = [
-            [12.75, 37.5], [7, 43.5], [7, 49.75], [12.75, 53.75], [12.75, 37.5]
-        ]
-        
-        inner_zone2 = [
-            [14.75, 37.5], [14.75, 43], [17.5, 40.25], [14.75, 37.5]
-        ]
-        
-        walls.append(left_wall)
-        walls.append(right_wall)
-        walls.append(inner_zone1)
-        walls.append(inner_zone2)
-        
-        pins = []
-        
-        top_pins = [
-            (15.5, 30.0), (15.5, 32), (15.5, 28),
-            (12.5, 30), (12.5, 32), (12.5, 28)
-        ]
-        for x, y in top_pins:
-            pins.append({'x': x, 'y': y, 'width': 0.2, 'height': 0.2, 'angle': -math.pi/4})
-        
-        diagonal_xs = [9.4, 11.3, 13.2, 15.1, 17, 18.9, 20.7, 22.7]
-        for x in diagonal_xs:
-            pins.append({'x': x, 'y': 66.6, 'width': 0.6, 'height': 0.1, 'angle': math.pi/4})
-        
-        for x in diagonal_xs:
-            pins.append({'x': x, 'y': 69.1, 'width': 0.6, 'height': 0.1, 'angle': -math.pi/4})
-        
-        pin_y92_xs = [9.5, 12.75, 16, 19.25, 22.5]
-        for x in pin_y92_xs:
-            pins.append({'x': x, 'y': 92, 'width': 0.25, 'height': 0.25, 'angle': 0.7853981633974483})
-        
-        pin_y95_xs = [11, 14.25, 17.5, 20.75]
-        for x in pin_y95_xs:
-            pins.append({'x': x, 'y': 95, 'width': 0.25, 'height': 0.25, 'angle': 0.7853981633974483})
-        
-        for x in pin_y92_xs:
-            pins.append({'x': x, 'y': 98, 'width': 0.25, 'height': 0.25, 'angle': 0.7853981633974483})
-        
         boxes = []
         for wheel in self.wheels:
             body = wheel['body']
             boxes.append({
-                'x': body.position.x, 'y': body.position.y,
-                'width': 2, 'height': 0.1, 'angle': body.angle
+                'x': body.position.x - self.offset_x, 'y': body.position.y,
+                'width': wheel['width'], 'height': wheel['height'],
+                'angle': body.angle
             })
         
         marbles_data = []
@@ -431,17 +463,16 @@ class PhysicsEngine:
             if not marble['finished']:
                 pos = marble['body'].position
                 marbles_data.append({
-                    'x': pos.x, 'y': pos.y,
+                    'x': pos.x - self.offset_x, 'y': pos.y,
                     'angle': marble['body'].angle,
                     'name': marble['name'], 'hue': marble['hue']
                 })
         
         return {
-            'walls': walls,
-            'pins': pins,
+            'track': self.track.hash,
             'boxes': boxes,
             'marbles': marbles_data,
-            'winners': self.winners,
+            'winners': list(self.winners),
             'total_marbles': len(self.marbles),
             'particles': self.particle_manager.get_data(),
             'skill_effects': [e.get_data() for e in self.skill_effects],
@@ -0,0 +1,119 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_INTERVAL = 0.005
+MAX_PROFILE_SECONDS = 60
+# Leaf frames of threads parked until there is work: tick sleeps, pool
+# workers (encoder, tpool) waiting on their queues, and threads or the
+# eventlet hub waiting for I/O.
+IDLE_LEAVES = frozenset({
+    "threading:Condition.wait",
+    "server:Server.sleep",
+    "selectors:_PollLikeSelector.select",
+    "selectors:SelectSelector.select",
+    "selectors:KqueueSelector.select",
+    "poll:Hub.do_poll",
+    "epolls:Hub.do_poll",
+    "selects:Hub.wait",
+    "kqueue:Hub.wait",
+})
+
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def frame_label(frame):
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{module}:{name}"
+
+
+def collapse_stack(frame):
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return ";".join(labels)
+
+
+def eventlet_patched():
+    patcher = sys.modules.get("eventlet.patcher")
+    return patcher is not None and patcher.is_monkey_patched("thread")
+
+
+def sample_stacks(seconds, include=None, interval=PROFILE_INTERVAL):
+    """Sample Python stacks and return them in collapsed-stack format.
+
+    ``include`` filters by task id, i.e. what ``threading.get_ident()``
+    returned inside the task: an OS thread ident normally, a greenlet id
+    under eventlet. Without it, samples of idle threads (``IDLE_LEAVES``)
+    are left out so the busy ones stand out.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+
+    try:
+        seconds = min(seconds, MAX_PROFILE_SECONDS)
+        if eventlet_patched():
+            counts = sample_green(seconds, include, interval)
+        else:
+            counts = collect(seconds, include, interval, time.sleep, threading.get_ident, None)
+    finally:
+        _profile_lock.release()
+
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+def sample_green(seconds, include, interval):
+    # Green threads all run on the hub's OS thread, and the profiler cannot
+    # sample it from a green thread of its own: by the time it runs, every
+    # other green thread is parked. The sampler runs on a real OS thread
+    # instead, where sys._current_frames() shows whatever greenlet is
+    # executing on the hub. A greenlet switch hook keeps track of which one
+    # that is, so samples can be attributed to a task id.
+    import greenlet
+    from eventlet import patcher, tpool
+
+    real_thread = patcher.original("_thread")
+    real_time = patcher.original("time")
+    hub_ident = real_thread.get_ident()
+    running = {hub_ident: id(greenlet.getcurrent())}
+
+    def trace(event, args):
+        if event in ("switch", "throw"):
+            running[hub_ident] = id(args[1])
+
+    previous = greenlet.settrace(trace)
+    try:
+        return tpool.execute(
+            collect, seconds, include, interval, real_time.sleep, real_thread.get_ident, running
+        )
+    finally:
+        greenlet.settrace(previous)
+
+
+def collect(seconds, include, interval, sleep, get_ident, running):
+    counts = Counter()
+    own_id = get_ident()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            task_id = running.get(thread_id, thread_id) if running else thread_id
+            if include is None:
+                if frame_label(frame) in IDLE_LEAVES:
+                    continue
+            elif not include(task_id):
+                continue
+            counts[collapse_stack(frame)] += 1
+        sleep(interval)
+    return counts
@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+
+from physics_engine import PhysicsEngine
+from step_policy import BASE_ITERATIONS, BASE_TIME_STEP, FAST_TIME_STEP
+
+BATCH_MAX_NAMES = int(os.environ.get("BATCH_MAX_NAMES", 20))
+BATCH_LANES = int(os.environ.get("BATCH_LANES", 32))
+BATCH_IDLE_TIMEOUT = 10.0
+LANE_MARGIN = 10
+
+
+def lane_pitch(track):
+    return track.max_x - track.min_x + LANE_MARGIN
+
+
+class RaceBatch:
+    def __init__(self, allow_sleep=False, lanes=BATCH_LANES, lane_width=None):
+        # Races join the base-step space and move to the fast one when their
+        # policy speeds up after ACCELERATE_AFTER; lanes keep their x offset
+        # in both, so a race never meets another one in either space.
+        self.spaces = {}
+        for time_step in (BASE_TIME_STEP, FAST_TIME_STEP):
+            space = PhysicsEngine.create_space(allow_sleep)
+            space.iterations = BASE_ITERATIONS
+            self.spaces[time_step] = space
+        self.space = self.spaces[BASE_TIME_STEP]
+        self.allow_sleep = allow_sleep
+        self.lane_width = lane_width
+        self.lanes = [None] * lanes
+        self.lock = threading.Lock()
+        self.retired = False
+        self.idle_since = time.time()
+
+    def add_race(self, names, track, owner=None):
+        with self.lock:
+            if self.retired:
+                return None
+            if self.lane_width is None:
+                self.lane_width = lane_pitch(track)
+            elif lane_pitch(track) > self.lane_width:
+                return None
+            for i, lane in enumerate(self.lanes):
+                if lane is None:
+                    break
+            else:
+                return None
+
+            # Each race gets its own copy of the track, far enough along x
+            # that marbles from different races can never touch.
+            engine = PhysicsEngine(
+                names, allow_sleep=self.allow_sleep, track=track,
+                space=self.space, offset_x=i * self.lane_width - track.min_x
+            )
+            self.lanes[i] = {'engine': engine, 'owner': owner}
+            return engine
+
+    def races(self):
+        return [lane for lane in self.lanes if lane is not None]
+
+    def set_owner(self, engine, owner):
+        with self.lock:
+            for lane in self.races():
+                if lane['engine'] is engine:
+                    lane['owner'] = owner
+
+    def remove_race(self, engine):
+        with self.lock:
+            for i, lane in enumerate(self.lanes):
+                if lane is not None and lane['engine'] is engine:
+                    engine.release()
+                    self.lanes[i] = None
+                    break
+            if not self.races():
+                self.idle_since = time.time()
+
+    def retire_if_idle(self):
+        with self.lock:
+            if not self.races() and time.time() - self.idle_since > BATCH_IDLE_TIMEOUT:
+                self.retired = True
+            return self.retired
+
+    def shared_time_step(self, engine):
+        plan = engine.step_policy.plan(engine)
+        if plan.substeps == 1 and plan.iterations == BASE_ITERATIONS and plan.time_step in self.spaces:
+            return plan.time_step
+        return None
+
+    def step(self):
+        with self.lock:
+            races = self.races()
+            steps = {}
+            for lane in races:
+                engine = lane['engine']
+                if not engine.is_running:
+                    continue
+                engine.update_clock()
+                time_step = self.shared_time_step(engine)
+                if time_step is None:
+                    # Neither shared space steps the way this race's policy
+                    # wants, so it carries on in a space of its own.
+                    if engine.space in self.spaces.values():
+                        engine.detach()
+                    continue
+                space = self.spaces[time_step]
+                if engine.space is not space:
+                    engine.detach(space)
+                steps[engine] = time_step
+
+            for time_step, space in self.spaces.items():
+                if time_step in steps.values():
+                    space.step(time_step)
+
+            for lane in races:
+                engine = lane['engine']
+                if engine in steps:
+                    engine.after_step(steps[engine])
+                else:
+                    engine.step()
+
+            return [(lane['engine'], lane['owner']) for lane in races]
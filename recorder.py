@@ -0,0 +1,295 @@
+import bisect
+import json
+import mmap
+import os
+import re
+import struct
+import time
+import uuid
+
+RECORD_DIR = os.environ.get("RECORD_DIR")
+KEYFRAME_INTERVAL = int(os.environ.get("RECORD_KEYFRAME_INTERVAL", 30))
+RECORD_MAX_FILES = int(os.environ.get("RECORD_MAX_FILES", 200))
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+MAGIC = b"RACE1\n"
+KEYFRAME = 1
+DELTA = 2
+RECORD_HEADER = struct.Struct("<BdI")
+INDEX_ENTRY = struct.Struct("<dQ")
+
+POSITION_DIGITS = 2
+ANGLE_DIGITS = 3
+# State keys that deltas encode specially; every other key is copied
+# whole when it changes.
+DELTA_STATE_KEYS = {'marbles', 'boxes', 'winners', 'particles', 'skill_effects'}
+DELTA_FIELDS = {'gone', 'm', 'b', 'w', 'p', 's'}
+
+
+def recording_path(session_id):
+    if not RECORD_DIR or not SESSION_ID_PATTERN.match(session_id):
+        return None
+    return os.path.join(RECORD_DIR, session_id + ".race")
+
+
+def prune_recordings(directory, keep):
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith(".race")]
+    except FileNotFoundError:
+        return 0
+    paths = [os.path.join(directory, name) for name in names]
+    paths.sort(key=_mtime, reverse=True)
+    removed = 0
+    # Unlinking is safe even while a replay has the file mapped: the map
+    # keeps the old inode alive until it is dropped.
+    for path in paths[keep:]:
+        for victim in (path, path + ".idx"):
+            try:
+                os.remove(victim)
+            except FileNotFoundError:
+                pass
+        removed += 1
+    return removed
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except FileNotFoundError:
+        return 0
+
+
+def _quantise_body(item):
+    return (
+        round(item['x'], POSITION_DIGITS),
+        round(item['y'], POSITION_DIGITS),
+        round(item['angle'], ANGLE_DIGITS),
+    )
+
+
+def _quantise_points(items, *keys):
+    return [[round(item[key], POSITION_DIGITS) for key in keys] for item in items]
+
+
+def _removed_indices(previous, current):
+    # Marbles only ever leave the list (they finish) and keep their order,
+    # so a two-pointer walk finds which previous entries are gone. None
+    # means the roster changed some other way and needs a keyframe.
+    removed = []
+    j = 0
+    for i, marble in enumerate(previous):
+        if j < len(current) and current[j][:2] == marble[:2]:
+            j += 1
+        else:
+            removed.append(i)
+    if j != len(current):
+        return None
+    return removed
+
+
+class RaceRecorder:
+    def __init__(self, path, keyframe_interval=KEYFRAME_INTERVAL, max_files=RECORD_MAX_FILES):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        if max_files:
+            prune_recordings(directory, max_files - 1)
+
+        # Never truncate in place: a replay may still have the previous
+        # recording of this session id mapped, and shrinking a mapped file
+        # turns the next read into SIGBUS. Both files are created under a
+        # unique name and renamed over the old ones, index first, so a
+        # reader that races the swap sees an empty index at worst.
+        token = f".{os.getpid()}-{uuid.uuid4().hex}.tmp"
+        self.index_file = open(path + ".idx" + token, "wb")
+        self.file = open(path + token, "wb")
+        self.file.write(MAGIC)
+        self.file.flush()
+        os.replace(path + ".idx" + token, path + ".idx")
+        os.replace(path + token, path)
+
+        self.offset = len(MAGIC)
+        self.keyframe_interval = keyframe_interval
+        self.since_keyframe = 0
+        self.previous = None
+        self.start = time.monotonic()
+
+    def record(self, frame):
+        t = time.monotonic() - self.start
+        state = frame.state
+        current = self.quantise(state)
+
+        delta = None
+        if self.previous is not None and self.since_keyframe < self.keyframe_interval:
+            delta = self.make_delta(self.previous, current)
+
+        if delta is None:
+            kind = KEYFRAME
+            payload = frame.payload.encode()
+            self.index_file.write(INDEX_ENTRY.pack(t, self.offset))
+            self.index_file.flush()
+            self.since_keyframe = 0
+        else:
+            kind = DELTA
+            payload = json.dumps(delta, separators=(",", ":")).encode()
+            self.since_keyframe += 1
+
+        self.file.write(RECORD_HEADER.pack(kind, t, len(payload)))
+        self.file.write(payload)
+        self.file.flush()
+        self.offset += RECORD_HEADER.size + len(payload)
+        self.previous = current
+
+    def quantise(self, state):
+        current = dict(state)
+        current['marbles'] = [
+            (m['name'], m['hue'], _quantise_body(m)) for m in state['marbles']
+        ]
+        current['boxes'] = [_quantise_body(b) for b in state['boxes']]
+        current['particles'] = _quantise_points(state['particles'], 'x', 'y', 'hue', 'alpha')
+        current['skill_effects'] = _quantise_points(state['skill_effects'], 'x', 'y', 'size', 'alpha')
+        return current
+
+    def make_delta(self, previous, current):
+        removed = _removed_indices(previous['marbles'], current['marbles'])
+        if removed is None or len(previous['boxes']) != len(current['boxes']):
+            return None
+        winners = current['winners']
+        if winners[:len(previous['winners'])] != previous['winners']:
+            return None
+
+        delta = {}
+        if removed:
+            delta['gone'] = removed
+        gone = set(removed)
+        kept = [m for i, m in enumerate(previous['marbles']) if i not in gone]
+        moved = [
+            [i, *body] for i, ((_, _, body), (_, _, old)) in enumerate(zip(current['marbles'], kept))
+            if body != old
+        ]
+        if moved:
+            delta['m'] = moved
+        boxes = [
+            [i, *body] for i, (body, old) in enumerate(zip(current['boxes'], previous['boxes']))
+            if body != old
+        ]
+        if boxes:
+            delta['b'] = boxes
+        if len(winners) > len(previous['winners']):
+            delta['w'] = winners[len(previous['winners']):]
+        if current['particles'] != previous['particles']:
+            delta['p'] = current['particles']
+        if current['skill_effects'] != previous['skill_effects']:
+            delta['s'] = current['skill_effects']
+        for key, value in current.items():
+            if key in DELTA_STATE_KEYS:
+                continue
+            if previous.get(key) != value:
+                delta[key] = value
+        return delta
+
+    def close(self):
+        self.file.close()
+        self.index_file.close()
+
+
+def apply_delta(state, delta):
+    state = dict(state)
+    marbles = state['marbles']
+    if 'gone' in delta:
+        gone = set(delta['gone'])
+        marbles = [m for i, m in enumerate(marbles) if i not in gone]
+    if 'm' in delta:
+        marbles = list(marbles)
+        for i, x, y, angle in delta['m']:
+            marbles[i] = dict(marbles[i], x=x, y=y, angle=angle)
+    state['marbles'] = marbles
+    if 'b' in delta:
+        boxes = list(state['boxes'])
+        for i, x, y, angle in delta['b']:
+            boxes[i] = dict(boxes[i], x=x, y=y, angle=angle)
+        state['boxes'] = boxes
+    if 'w' in delta:
+        state['winners'] = state['winners'] + delta['w']
+    if 'p' in delta:
+        state['particles'] = [
+            {'x': x, 'y': y, 'hue': hue, 'alpha': alpha} for x, y, hue, alpha in delta['p']
+        ]
+    if 's' in delta:
+        state['skill_effects'] = [
+            {'x': x, 'y': y, 'size': size, 'alpha': alpha} for x, y, size, alpha in delta['s']
+        ]
+    for key, value in delta.items():
+        if key not in DELTA_FIELDS:
+            state[key] = value
+    return state
+
+
+class RaceReplay:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = None
+        try:
+            self.remap()
+        except ValueError:
+            self.file.close()
+            raise
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"Not a race recording: {path}")
+
+    def remap(self):
+        size = os.fstat(self.file.fileno()).st_size
+        if size == 0:
+            raise ValueError(f"Empty race recording: {self.path}")
+        if self.map is not None and len(self.map) == size:
+            return False
+        # Slices handed out by records() keep the old map alive until they
+        # are dropped, so it is left for the garbage collector.
+        self.map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ)
+        return True
+
+    def is_replaced(self):
+        # A new recording under the same session id is renamed over this
+        # one; the open file keeps reading the old race, which never grows.
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self.file.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def load_index(self):
+        try:
+            with open(self.path + ".idx", "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        count = len(data) // INDEX_ENTRY.size
+        return [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size) for i in range(count)]
+
+    def seek(self, t):
+        index = self.load_index()
+        if not index:
+            return len(MAGIC)
+        times = [entry[0] for entry in index]
+        position = max(bisect.bisect_right(times, t) - 1, 0)
+        return index[position][1]
+
+    def records(self, offset):
+        view = memoryview(self.map)
+        while offset + RECORD_HEADER.size <= len(view):
+            kind, t, length = RECORD_HEADER.unpack_from(view, offset)
+            start = offset + RECORD_HEADER.size
+            if start + length > len(view):
+                return
+            offset = start + length
+            yield kind, t, view[start:offset], offset
+
+    def chunks(self, offset, chunk_size=256 * 1024):
+        view = memoryview(self.map)
+        while offset < len(view):
+            yield bytes(view[offset:offset + chunk_size])
+            offset += chunk_size
+
+    def close(self):
+        self.map = None
+        self.file.close()
@@ -0,0 +1,300 @@
+import argparse
+import json
+import os
+import struct
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import Client, Listener
+
+RELAY_QUEUE_SIZE = int(os.environ.get("RELAY_QUEUE_SIZE", 8))
+RELAY_INTERVAL = 0.033
+FRAME_EVENT = "physics_update"
+SUBSCRIBE_EVENT = "subscribe"
+UNSUBSCRIBE_EVENT = "unsubscribe"
+# Payload kind (s: text, b: bytes), then event and room lengths in bytes.
+MESSAGE_HEADER = struct.Struct("!cII")
+
+
+def parse_address(value):
+    host, _, port = value.rpartition(":")
+    return (host or "127.0.0.1", int(port))
+
+
+def get_authkey():
+    return os.environ.get("RELAY_AUTHKEY", "roulette-relay").encode()
+
+
+def pack_message(event, room, payload):
+    if isinstance(payload, str):
+        kind = b"s"
+        payload = payload.encode()
+    else:
+        kind = b"b"
+    # Rooms are session ids chosen by clients, so fields are length-prefixed
+    # rather than separated by a byte a room name could contain.
+    event = event.encode()
+    room = room.encode()
+    return MESSAGE_HEADER.pack(kind, len(event), len(room)) + event + room + payload
+
+
+def unpack_message(data):
+    kind, event_size, room_size = MESSAGE_HEADER.unpack_from(data)
+    start = MESSAGE_HEADER.size
+    event = data[start:start + event_size]
+    room = data[start + event_size:start + event_size + room_size]
+    payload = data[start + event_size + room_size:]
+    if kind == b"s":
+        payload = payload.decode()
+    return event.decode(), room.decode(), payload
+
+
+class RelayLink:
+    def __init__(self, conn, queue_size, on_subscribe=None):
+        self.conn = conn
+        self.queue = deque(maxlen=queue_size)
+        self.ready = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+        self.rooms = set()
+        self.on_subscribe = on_subscribe
+
+        threading.Thread(target=self.send_loop, daemon=True).start()
+        threading.Thread(target=self.receive_loop, daemon=True).start()
+
+    def offer(self, data):
+        with self.ready:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append(data)
+            self.ready.notify()
+        return not self.closed
+
+    def send_loop(self):
+        while not self.closed:
+            with self.ready:
+                while not self.queue and not self.closed:
+                    self.ready.wait()
+                if self.closed:
+                    break
+                data = self.queue.popleft()
+            try:
+                self.conn.send_bytes(data)
+            except (OSError, EOFError):
+                self.closed = True
+        self.conn.close()
+
+    def receive_loop(self):
+        # Relays tell the publisher which rooms their viewers are in, so
+        # frames only go where someone is watching.
+        while not self.closed:
+            try:
+                event, room, _ = unpack_message(self.conn.recv_bytes())
+            except (OSError, EOFError, ValueError):
+                self.closed = True
+                break
+            if event == SUBSCRIBE_EVENT:
+                self.rooms.add(room)
+                if self.on_subscribe:
+                    self.on_subscribe(self, room)
+            elif event == UNSUBSCRIBE_EVENT:
+                self.rooms.discard(room)
+        with self.ready:
+            self.ready.notify()
+
+
+class RelayPublisher:
+    def __init__(self, address, authkey, queue_size=RELAY_QUEUE_SIZE, latest_payload=None):
+        self.listener = Listener(address, authkey=authkey)
+        self.queue_size = queue_size
+        self.latest_payload = latest_payload
+        self.links = []
+        self.lock = threading.Lock()
+
+        thread = threading.Thread(target=self.accept_loop, daemon=True)
+        thread.start()
+        print(f"Relay publisher listening on {address[0]}:{address[1]}")
+
+    def accept_loop(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except Exception as e:
+                print(f"Relay connection rejected: {e}")
+                continue
+            with self.lock:
+                self.links = [link for link in self.links if not link.closed]
+                self.links.append(RelayLink(conn, self.queue_size, self.send_latest))
+            print(f"Relay connected ({len(self.links)} total)")
+
+    def send_latest(self, link, room):
+        payload = self.latest_payload(room) if self.latest_payload else None
+        if payload is not None:
+            link.offer(pack_message(FRAME_EVENT, room, payload))
+
+    def has_subscribers(self, room):
+        return any(room in link.rooms for link in self.links)
+
+    def publish(self, event, room, payload):
+        links = [link for link in self.links if room in link.rooms]
+        if not links:
+            return
+        data = pack_message(event, room, payload)
+        for link in links:
+            link.offer(data)
+        with self.lock:
+            self.links = [link for link in self.links if not link.closed]
+
+
+def create_relay_app(upstream, authkey):
+    from flask import Flask, request
+    from flask_cors import CORS
+    from flask_socketio import SocketIO, emit, join_room
+
+    from client_assets import ClientAssets
+    from track import TRACK_DIR, get_track_by_hash, load_track
+    from viewers import ViewerRegistry
+
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "roulette-relay"
+    CORS(app)
+    socketio = SocketIO(app, cors_allowed_origins="*", async_mode="threading")
+
+    client_assets = ClientAssets()
+    for filename in os.listdir(TRACK_DIR):
+        if filename.endswith(".json"):
+            load_track(filename[:-5])
+    latest_frames = {}
+    pending_frames = {}
+    pending_lock = threading.Lock()
+    viewers = ViewerRegistry()
+    upstream_conn = None
+    upstream_lock = threading.Lock()
+
+    def send_upstream(event, room):
+        with upstream_lock:
+            if upstream_conn is None:
+                return
+            try:
+                upstream_conn.send_bytes(pack_message(event, room, b""))
+            except (OSError, EOFError):
+                pass
+
+    def join_session(session_id):
+        join_room(session_id)
+        if viewers.join(session_id, request.sid, None):
+            send_upstream(SUBSCRIBE_EVENT, session_id)
+
+    @app.route("/")
+    def index():
+        return client_assets.serve_shell(request)
+
+    @app.route("/assets/<name>")
+    def asset(name):
+        return client_assets.serve_asset(name, request)
+
+    @app.route("/tracks/<track_hash>")
+    def track_payload(track_hash):
+        track = get_track_by_hash(track_hash)
+        if track is None:
+            return {"success": False, "message": "Track not found"}, 404
+        return client_assets.serve_track(track, request)
+
+    @socketio.on("connect")
+    def handle_connect():
+        emit("connected", {"status": "ready"})
+
+    @socketio.on("join")
+    def on_join(data):
+        session_id = data.get("session_id")
+        if not session_id:
+            return
+        join_session(session_id)
+        payload = latest_frames.get(session_id)
+        if payload is not None:
+            emit(FRAME_EVENT, payload)
+
+    @socketio.on("rejoin_session")
+    def handle_rejoin(data):
+        session_id = data.get("session_id")
+        if not session_id:
+            return
+        join_session(session_id)
+        payload = latest_frames.get(session_id)
+        if payload is not None:
+            emit(FRAME_EVENT, payload)
+        emit("session_restored", {"success": payload is not None})
+
+    @socketio.on("disconnect")
+    def handle_disconnect():
+        for room in viewers.leave_all(request.sid):
+            send_upstream(UNSUBSCRIBE_EVENT, room)
+            latest_frames.pop(room, None)
+
+    @socketio.on("start_lottery")
+    def handle_start(data):
+        emit("session_error", {"message": "Races can only be started on the primary server"})
+
+    def flush_room(room):
+        with pending_lock:
+            payload = pending_frames.pop(room, None)
+        if payload is not None:
+            socketio.emit(FRAME_EVENT, payload, to=room)
+
+    def receive_loop():
+        nonlocal upstream_conn
+        address = parse_address(upstream)
+        while True:
+            try:
+                conn = Client(address, authkey=authkey)
+            except Exception as e:
+                print(f"Relay upstream unavailable ({e}), retrying")
+                time.sleep(1)
+                continue
+
+            with upstream_lock:
+                upstream_conn = conn
+            for room in viewers.room_names():
+                send_upstream(SUBSCRIBE_EVENT, room)
+            print(f"Relay subscribed to {upstream}")
+            try:
+                while True:
+                    event, room, payload = unpack_message(conn.recv_bytes())
+                    if event == FRAME_EVENT:
+                        latest_frames[room] = payload
+                        with pending_lock:
+                            pending_frames[room] = payload
+                        continue
+
+                    flush_room(room)
+                    socketio.emit(event, json.loads(payload), to=room)
+                    if event == "session_closed":
+                        latest_frames.pop(room, None)
+            except (OSError, EOFError):
+                print("Relay upstream disconnected, reconnecting")
+                with upstream_lock:
+                    upstream_conn = None
+                conn.close()
+
+    def broadcast_loop():
+        while True:
+            with pending_lock:
+                frames = list(pending_frames.items())
+                pending_frames.clear()
+            for room, payload in frames:
+                socketio.emit(FRAME_EVENT, payload, to=room)
+            socketio.sleep(RELAY_INTERVAL)
+
+    threading.Thread(target=receive_loop, daemon=True).start()
+    threading.Thread(target=broadcast_loop, daemon=True).start()
+    return app, socketio
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Spectator fan-out relay")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 5001)))
+    parser.add_argument("--upstream", default=os.environ.get("RELAY_PUBLISH", "127.0.0.1:6001"))
+    args = parser.parse_args()
+
+    relay_app, relay_socketio = create_relay_app(args.upstream, get_authkey())
+    relay_socketio.run(relay_app, host="0.0.0.0", port=args.port, debug=False, allow_unsafe_werkzeug=True)
@@ -0,0 +1,236 @@
+import os
+import threading
+import time
+
+from frames import Frame
+
+SESSION_IDLE_TTL = float(os.environ.get("SESSION_IDLE_TTL", 300))
+SESSION_MAX_AGE = float(os.environ.get("SESSION_MAX_AGE", 1800))
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", 200))
+MAX_TOTAL_MARBLES = int(os.environ.get("MAX_TOTAL_MARBLES", 20000))
+MAX_SESSION_BYTES = int(os.environ.get("MAX_SESSION_BYTES", 512 * 1024 * 1024))
+REAPER_INTERVAL = 5.0
+
+# Rough per-object costs of a pymunk body/shape plus the Python-side
+# bookkeeping the engine keeps for it.
+MARBLE_BYTES = 2048
+STATIC_SHAPE_BYTES = 512
+
+
+class SessionLimitError(Exception):
+    pass
+
+
+class Session:
+    def __init__(self, session_id, engine):
+        self.session_id = session_id
+        self.engine = engine
+        self.frame = None
+        self.tick = 0
+        self.task = None
+        self.thread_id = None
+        self.created_at = time.time()
+        self.last_activity = self.created_at
+        self.finished_count = 0
+        self.closed = False
+        self.tick_seconds = 0.0
+        self.recorder = None
+        self.state_seconds = 0.0
+        self.skipped_frames = 0
+        self.skipped_bytes = 0
+        self.saved_seconds = 0.0
+        self.frame_wanted = False
+
+    def publish(self, state):
+        self.tick += 1
+        frame = Frame(self.tick, state)
+        self.frame = frame
+
+        finished_count = len(state["winners"])
+        if finished_count != self.finished_count:
+            self.finished_count = finished_count
+            self.touch()
+        return frame
+
+    def record_state_time(self, seconds):
+        self.state_seconds += (seconds - self.state_seconds) * 0.1
+
+    def record_skip(self):
+        # Nobody is watching, so the frame that would have been built and
+        # encoded is only counted: its size and build time are estimated
+        # from the last frame that was actually published.
+        self.skipped_frames += 1
+        self.saved_seconds += self.state_seconds
+        frame = self.frame
+        if frame is not None:
+            self.skipped_bytes += frame.encoded_size()
+
+        finished_count = len(self.engine.winners)
+        if finished_count != self.finished_count:
+            self.finished_count = finished_count
+            self.touch()
+
+    def record_tick(self, seconds):
+        self.tick_seconds += (seconds - self.tick_seconds) * 0.1
+
+    def touch(self):
+        self.last_activity = time.time()
+
+    def marble_count(self):
+        return len(self.engine.marbles)
+
+    def memory_estimate(self):
+        active = sum(1 for m in self.engine.marbles if not m["finished"])
+        static_shapes = len(self.engine.static_shapes)
+        frame = self.frame
+        frame_bytes = frame.encoded_size() if frame else 0
+        return active * MARBLE_BYTES + static_shapes * STATIC_SHAPE_BYTES + frame_bytes
+
+    def expiry_reason(self, now):
+        if self.task is not None and not is_task_alive(self.task):
+            return "task exited"
+        if now - self.created_at > SESSION_MAX_AGE:
+            return "max age exceeded"
+        if now - self.last_activity > SESSION_IDLE_TTL:
+            return "idle"
+        return None
+
+    def get_stats(self, now):
+        return {
+            "session_id": self.session_id,
+            "marbles": self.marble_count(),
+            "finished": self.finished_count,
+            "age": now - self.created_at,
+            "idle": now - self.last_activity,
+            "memory_bytes": self.memory_estimate(),
+            "tick_ms": self.tick_seconds * 1000,
+            "skipped_frames": self.skipped_frames,
+            "skipped_bytes": self.skipped_bytes,
+            "saved_ms": self.saved_seconds * 1000,
+        }
+
+
+def is_task_alive(task):
+    if hasattr(task, "is_alive"):
+        return task.is_alive()
+    # engineio wraps eventlet background tasks; the green thread is ``g``.
+    green = getattr(task, "g", task)
+    return green is None or not green.dead
+
+
+def read_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class SessionManager:
+    def __init__(self, on_reap=None):
+        self.sessions = {}
+        self.pending_tournaments = set()
+        self.lock = threading.Lock()
+        self.on_reap = on_reap
+        self.reaped_count = 0
+        self.reaper = None
+
+    def get(self, session_id):
+        return self.sessions.get(session_id)
+
+    def check_capacity(self, marble_count):
+        with self.lock:
+            self._check_capacity(marble_count)
+
+    def _check_capacity(self, marble_count):
+        if len(self.sessions) >= MAX_SESSIONS:
+            raise SessionLimitError("Too many concurrent sessions")
+        total_marbles = sum(s.marble_count() for s in self.sessions.values())
+        if total_marbles + marble_count > MAX_TOTAL_MARBLES:
+            raise SessionLimitError("Too many marbles in concurrent sessions")
+        total_bytes = sum(s.memory_estimate() for s in self.sessions.values())
+        if total_bytes + marble_count * MARBLE_BYTES > MAX_SESSION_BYTES:
+            raise SessionLimitError("Session memory budget exhausted")
+
+    def register(self, session):
+        with self.lock:
+            if session.session_id in self.sessions:
+                return False
+            self._check_capacity(session.marble_count())
+            self.sessions[session.session_id] = session
+            return True
+
+    def remove(self, session):
+        with self.lock:
+            if self.sessions.get(session.session_id) is not session:
+                return False
+            del self.sessions[session.session_id]
+            return True
+
+    def pop(self, session_id):
+        with self.lock:
+            return self.sessions.pop(session_id, None)
+
+    def reserve_tournament(self, session_id):
+        with self.lock:
+            if session_id in self.sessions or session_id in self.pending_tournaments:
+                return False
+            self.pending_tournaments.add(session_id)
+            return True
+
+    def release_tournament(self, session_id):
+        with self.lock:
+            self.pending_tournaments.discard(session_id)
+
+    def start_reaper(self, start_task, sleep=time.sleep):
+        if self.reaper is None:
+            self.reaper = start_task(self.reap_loop, sleep)
+
+    def reap_loop(self, sleep=time.sleep):
+        while True:
+            sleep(REAPER_INTERVAL)
+            try:
+                self.reap()
+            except Exception as e:
+                print(f"Session reaper error: {e}")
+
+    def reap(self):
+        now = time.time()
+        expired = []
+        with self.lock:
+            for session in list(self.sessions.values()):
+                reason = session.expiry_reason(now)
+                if reason:
+                    del self.sessions[session.session_id]
+                    expired.append((session, reason))
+
+        for session, reason in expired:
+            self.reaped_count += 1
+            session.engine.stop()
+            print(f"Session reaped ({reason}): {session.session_id}")
+            if self.on_reap:
+                self.on_reap(session)
+        return len(expired)
+
+    def get_stats(self):
+        now = time.time()
+        sessions = [s.get_stats(now) for s in list(self.sessions.values())]
+        return {
+            "sessions": sessions,
+            "session_count": len(sessions),
+            "pending_tournaments": len(self.pending_tournaments),
+            "total_marbles": sum(s["marbles"] for s in sessions),
+            "total_memory_bytes": sum(s["memory_bytes"] for s in sessions),
+            "skipped_frames": sum(s["skipped_frames"] for s in sessions),
+            "skipped_bytes": sum(s["skipped_bytes"] for s in sessions),
+            "reaped": self.reaped_count,
+            "rss_bytes": read_rss_bytes(),
+            "limits": {
+                "max_sessions": MAX_SESSIONS,
+                "max_total_marbles": MAX_TOTAL_MARBLES,
+                "max_session_bytes": MAX_SESSION_BYTES,
+                "idle_ttl": SESSION_IDLE_TTL,
+                "max_age": SESSION_MAX_AGE,
+            },
+        }
@@ -0,0 +1,97 @@
+import os
+
+BASE_TIME_STEP = 0.0125
+FAST_TIME_STEP = 0.0155
+BASE_ITERATIONS = 6
+ACCELERATE_AFTER = 60
+
+
+class StepPlan:
+    __slots__ = ("substeps", "time_step", "iterations")
+
+    def __init__(self, substeps, time_step, iterations):
+        self.substeps = substeps
+        self.time_step = time_step
+        self.iterations = iterations
+
+
+class FixedStepPolicy:
+    track_contacts = False
+
+    def plan(self, engine):
+        time_step = BASE_TIME_STEP
+        if engine.elapsed_time > ACCELERATE_AFTER:
+            time_step = FAST_TIME_STEP
+        return StepPlan(1, time_step, BASE_ITERATIONS)
+
+
+class AdaptiveStepPolicy:
+    track_contacts = True
+
+    def __init__(
+        self,
+        min_iterations=BASE_ITERATIONS,
+        max_iterations=8,
+        max_time_step=FAST_TIME_STEP,
+        max_substeps=3,
+        stall_seconds=4.0,
+        sparse_contacts=1.0,
+        crowded_contacts=2.5,
+        final_marbles=2,
+        open_chute_progress=0.25,
+    ):
+        self.min_iterations = min_iterations
+        self.max_iterations = max_iterations
+        self.max_time_step = max_time_step
+        self.max_substeps = max_substeps
+        self.stall_seconds = stall_seconds
+        self.sparse_contacts = sparse_contacts
+        self.crowded_contacts = crowded_contacts
+        self.final_marbles = final_marbles
+        self.open_chute_progress = open_chute_progress
+
+    def plan(self, engine):
+        active = engine.active_count
+        if active == 0:
+            return StepPlan(1, BASE_TIME_STEP, self.min_iterations)
+
+        # Solver effort follows how tightly the marbles are packed: a jammed
+        # funnel needs more iterations. A marble rolling along one surface
+        # already has a contact, so "sparse" is about one per marble; the
+        # median measured on the default track is 1.3-1.5.
+        contacts = engine.contact_count / active
+        if contacts <= self.sparse_contacts:
+            iterations = self.min_iterations
+        elif contacts >= self.crowded_contacts:
+            iterations = self.max_iterations
+        else:
+            span = self.crowded_contacts - self.sparse_contacts
+            fraction = (contacts - self.sparse_contacts) / span
+            iterations = round(self.min_iterations + fraction * (self.max_iterations - self.min_iterations))
+
+        time_step = BASE_TIME_STEP
+        if (
+            contacts <= self.sparse_contacts
+            or engine.pack_progress < self.open_chute_progress
+            or engine.elapsed_time > ACCELERATE_AFTER
+        ):
+            time_step = self.max_time_step
+
+        # Time scale grows while nothing finishes and drops back to real time
+        # for the deciding marbles.
+        substeps = 1 + int(engine.time_since_finish / self.stall_seconds)
+        if active <= self.final_marbles:
+            substeps = 1
+        substeps = min(substeps, self.max_substeps)
+
+        return StepPlan(substeps, time_step, iterations)
+
+
+def make_step_policy(name=None):
+    name = name or os.environ.get("STEP_POLICY", "fixed")
+    if name == "adaptive":
+        return AdaptiveStepPolicy(
+            min_iterations=int(os.environ.get("STEP_MIN_ITERATIONS", BASE_ITERATIONS)),
+            max_substeps=int(os.environ.get("STEP_MAX_SUBSTEPS", 3)),
+        )
+    return FixedStepPolicy()
@@ -0,0 +1,41 @@
+import threading
+
+from profiler import sample_stacks
+
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_whole_process_profile_skips_idle_threads():
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=spin, args=(stop,)),
+        threading.Thread(target=stop.wait),
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        stacks = sample_stacks(0.2)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    leaves = {line.rsplit(" ", 1)[0].split(";")[-1] for line in stacks.splitlines()}
+    assert "test_profiler:spin" in leaves
+    assert "threading:Condition.wait" not in leaves
+
+
+def test_session_profile_keeps_idle_samples():
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait)
+    thread.start()
+    try:
+        stacks = sample_stacks(0.1, include=lambda task_id: task_id == thread.ident)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert stacks.splitlines()[0].rsplit(" ", 1)[0].endswith("threading:Condition.wait")
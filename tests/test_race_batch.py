@@ -0,0 +1,73 @@
+from race_batch import RaceBatch, lane_pitch
+from step_policy import ACCELERATE_AFTER, BASE_TIME_STEP, FAST_TIME_STEP
+from track import load_track
+
+
+def names(count, prefix="m"):
+    return [f"{prefix}{i}" for i in range(count)]
+
+
+def space_bodies(space):
+    return set(space.bodies)
+
+
+def race_bodies(engine):
+    return {m['body'] for m in engine.marbles if not m['finished']} | {w['body'] for w in engine.wheels}
+
+
+def test_races_get_separate_lanes():
+    track = load_track()
+    batch = RaceBatch(lanes=3)
+    engines = [batch.add_race(names(5, p), track) for p in "abc"]
+    assert batch.add_race(names(5), track) is None
+
+    pitch = lane_pitch(track)
+    assert [e.offset_x for e in engines] == [i * pitch - track.min_x for i in range(3)]
+    for i, engine in enumerate(engines):
+        for marble in engine.marbles:
+            assert i * pitch <= marble['body'].position.x < (i + 1) * pitch
+        assert engine.space is batch.spaces[BASE_TIME_STEP]
+
+
+def test_removed_race_frees_its_lane_and_bodies():
+    track = load_track()
+    batch = RaceBatch(lanes=2)
+    first = batch.add_race(names(5), track)
+    second = batch.add_race(names(5), track)
+    bodies = race_bodies(first)
+    static_count = len(first.static_shapes)
+    shapes_before = len(batch.space.shapes)
+
+    batch.remove_race(first)
+    assert not bodies & space_bodies(batch.space)
+    assert len(batch.space.shapes) == shapes_before - len(bodies) - static_count
+    assert [lane['engine'] for lane in batch.races()] == [second]
+
+    third = batch.add_race(names(5), track)
+    assert third.offset_x == first.offset_x
+
+
+def test_accelerated_race_moves_to_the_fast_space():
+    track = load_track()
+    batch = RaceBatch(lanes=2)
+    slow = batch.add_race(names(5, "s"), track)
+    fast = batch.add_race(names(5, "f"), track)
+    slow.start()
+    fast.start()
+    fast.start_time -= ACCELERATE_AFTER + 1
+
+    races = batch.step()
+    assert {engine for engine, _ in races} == {slow, fast}
+    assert slow.space is batch.spaces[BASE_TIME_STEP]
+    assert fast.space is batch.spaces[FAST_TIME_STEP]
+    assert race_bodies(fast) <= space_bodies(batch.spaces[FAST_TIME_STEP])
+    assert not race_bodies(fast) & space_bodies(batch.spaces[BASE_TIME_STEP])
+    assert slow.sim_time == BASE_TIME_STEP
+    assert fast.sim_time == FAST_TIME_STEP
+
+    batch.step()
+    assert fast.space is batch.spaces[FAST_TIME_STEP]
+    assert fast.sim_time == 2 * FAST_TIME_STEP
+
+    batch.remove_race(fast)
+    assert not space_bodies(batch.spaces[FAST_TIME_STEP])
@@ -0,0 +1,146 @@
+import json
+import os
+
+import pytest
+
+from frames import Frame
+from physics_engine import PhysicsEngine
+from recorder import (
+    DELTA,
+    KEYFRAME,
+    MAGIC,
+    RaceRecorder,
+    RaceReplay,
+    apply_delta,
+    prune_recordings,
+)
+
+
+def race_frames(count, names=20):
+    engine = PhysicsEngine([f"m{i}" for i in range(names)])
+    engine.start()
+    frames = []
+    for tick in range(count):
+        frames.append(Frame(tick, engine.update()))
+    return frames
+
+
+def replay_states(replay, offset):
+    states = []
+    state = None
+    for kind, t, payload, offset in replay.records(offset):
+        data = json.loads(bytes(payload))
+        state = data if kind == KEYFRAME else apply_delta(state, data)
+        states.append((kind, state))
+    return states
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "race.race")
+
+
+def test_new_recording_is_readable_immediately(path):
+    recorder = RaceRecorder(path)
+    replay = RaceReplay(path)
+    assert list(replay.records(replay.seek(0))) == []
+    replay.close()
+    recorder.close()
+
+
+def test_round_trip_matches_within_quantisation(path):
+    frames = race_frames(120)
+    recorder = RaceRecorder(path, keyframe_interval=30)
+    for frame in frames:
+        recorder.record(frame)
+    recorder.close()
+
+    replay = RaceReplay(path)
+    states = replay_states(replay, len(MAGIC))
+    replay.close()
+
+    assert len(states) == len(frames)
+    assert [kind for kind, _ in states].count(KEYFRAME) == 4
+    for frame, (_, state) in zip(frames, states):
+        original = frame.state
+        assert [m['name'] for m in state['marbles']] == [m['name'] for m in original['marbles']]
+        for got, want in zip(state['marbles'] + state['boxes'], original['marbles'] + original['boxes']):
+            assert got['x'] == pytest.approx(want['x'], abs=0.006)
+            assert got['y'] == pytest.approx(want['y'], abs=0.006)
+            assert got['angle'] == pytest.approx(want['angle'], abs=0.0006)
+        assert state['winners'] == original['winners']
+        assert state['elapsed_time'] == original['elapsed_time']
+
+
+def test_deltas_are_much_smaller_than_keyframes(path):
+    recorder = RaceRecorder(path, keyframe_interval=30)
+    for frame in race_frames(60):
+        recorder.record(frame)
+    recorder.close()
+
+    replay = RaceReplay(path)
+    sizes = {KEYFRAME: [], DELTA: []}
+    for kind, _, payload, _ in replay.records(len(MAGIC)):
+        sizes[kind].append(len(payload))
+    replay.close()
+
+    keyframe = sum(sizes[KEYFRAME]) / len(sizes[KEYFRAME])
+    delta = sum(sizes[DELTA]) / len(sizes[DELTA])
+    assert delta < keyframe / 2
+
+
+def test_seek_lands_on_keyframe(path):
+    recorder = RaceRecorder(path, keyframe_interval=10)
+    for frame in race_frames(45):
+        recorder.record(frame)
+    recorder.close()
+
+    replay = RaceReplay(path)
+    index = replay.load_index()
+    assert len(index) == 5
+    assert replay.seek(-1) == index[0][1]
+    assert replay.seek(index[2][0]) == index[2][1]
+    kind, _, _, _ = next(replay.records(replay.seek(1e9)))
+    assert kind == KEYFRAME
+    replay.close()
+
+
+def test_remap_follows_a_growing_recording(path):
+    frames = race_frames(20)
+    recorder = RaceRecorder(path)
+    recorder.record(frames[0])
+    replay = RaceReplay(path)
+    assert len(list(replay.records(len(MAGIC)))) == 1
+
+    for frame in frames[1:]:
+        recorder.record(frame)
+    assert replay.remap()
+    assert not replay.remap()
+    assert len(replay_states(replay, len(MAGIC))) == 20
+    recorder.close()
+    replay.close()
+
+
+def test_rerecording_keeps_open_replays_valid(path):
+    recorder = RaceRecorder(path)
+    for frame in race_frames(40):
+        recorder.record(frame)
+    recorder.close()
+
+    replay = RaceReplay(path)
+    slices = [payload for _, _, payload, _ in replay.records(len(MAGIC))]
+    RaceRecorder(path).close()
+
+    assert replay.is_replaced()
+    assert all(json.loads(bytes(payload)) is not None for payload in slices)
+    assert os.path.getsize(path) == len(MAGIC)
+    replay.close()
+
+
+def test_prune_recordings_keeps_newest(tmp_path):
+    for i in range(5):
+        path = tmp_path / f"s{i}.race"
+        RaceRecorder(str(path), max_files=0).close()
+        os.utime(path, (i, i))
+    assert prune_recordings(str(tmp_path), 2) == 3
+    assert sorted(os.listdir(tmp_path)) == ["s3.race", "s3.race.idx", "s4.race", "s4.race.idx"]
@@ -0,0 +1,19 @@
+import pytest
+
+from relay import FRAME_EVENT, SUBSCRIBE_EVENT, pack_message, unpack_message
+
+
+@pytest.mark.parametrize("room, payload", [
+    ("session-1", '{"t": 1}'),
+    ("session-1", b"\x00\x01binary"),
+    ("a\x00b", "text\x00with\x00nuls"),
+    ("", b""),
+    ("café", "é"),
+])
+def test_messages_round_trip(room, payload):
+    assert unpack_message(pack_message(FRAME_EVENT, room, payload)) == (FRAME_EVENT, room, payload)
+
+
+def test_nul_in_room_does_not_leak_into_event_or_payload():
+    event, room, payload = unpack_message(pack_message(SUBSCRIBE_EVENT, "x\x00physics_update", b""))
+    assert (event, room, payload) == (SUBSCRIBE_EVENT, "x\x00physics_update", b"")
@@ -0,0 +1,67 @@
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import tournament
+from tournament import heat_advance, run_heat, run_heats, split_heats
+
+
+def names(count):
+    return [f"m{i}" for i in range(count)]
+
+
+def test_split_heats_balances_and_keeps_everyone():
+    heats = split_heats(names(250), heat_size=100)
+    assert [len(heat) for heat in heats] == [84, 83, 83]
+    assert sorted(sum(heats, [])) == sorted(names(250))
+
+
+def test_split_heats_single_heat_when_it_fits():
+    assert split_heats(names(100), heat_size=100) == [names(100)]
+
+
+def test_heat_advance_keeps_finalists_per_heat_when_final_fits():
+    heats = split_heats(names(300), heat_size=100)
+    assert heat_advance(heats, rank=1, final_size=100) == tournament.FINALISTS_PER_HEAT
+
+
+def test_heat_advance_halves_heats_for_large_ranks():
+    heats = split_heats(names(300), heat_size=100)
+    assert heat_advance(heats, rank=80, final_size=100) == 50
+
+
+def test_heat_advance_never_thins_below_final():
+    heats = [names(3)] * 40
+    assert heat_advance(heats, rank=1, final_size=100) == 3
+
+
+def test_run_heat_advances_everyone_when_nobody_is_cut():
+    heat = names(5)
+    assert sorted(run_heat(heat, advance=5)) == heat
+
+
+def test_run_heat_returns_the_last_marbles_on_track():
+    heat = names(12)
+    finalists = run_heat(heat, advance=3)
+    assert len(finalists) == 3
+    assert set(finalists) <= set(heat)
+
+
+class BrokenExecutor:
+    def __init__(self):
+        self.shut_down = False
+
+    def submit(self, *args):
+        raise BrokenProcessPool("worker died")
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+def test_broken_pool_is_rebuilt(monkeypatch):
+    broken = BrokenExecutor()
+    monkeypatch.setattr(tournament, "_executor", broken)
+    with pytest.raises(BrokenProcessPool):
+        run_heats(names(150))
+    assert broken.shut_down
+    assert tournament._executor is None
@@ -0,0 +1,52 @@
+import json
+import os
+import re
+
+import pytest
+
+from physics_engine import PhysicsEngine
+from track import TRACK_DIR, Track, TrackError
+
+
+@pytest.fixture
+def data():
+    with open(os.path.join(TRACK_DIR, "default.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("patch, message", [
+    ({"goal_y": float("nan")}, "goal_y must be a number"),
+    ({"goal_y": float("inf")}, "goal_y must be a number"),
+    ({"spawn": None}, "spawn must be an object"),
+    ({"camera": {"bands": [{"until_y": 50, "zoom": [0, 15]}]}}, "camera.bands[0].zoom must be positive"),
+    ({"camera": {"bands": [{"until_y": 50, "zoom": [10, 15]}, {"until_y": 40, "zoom": [15, 20]}]}},
+     "camera.bands[1].until_y must be below the previous band"),
+])
+def test_invalid_fields_are_rejected(data, patch, message):
+    data.update(patch)
+    with pytest.raises(TrackError, match=re.escape(message)):
+        Track("test", data)
+
+
+@pytest.mark.parametrize("key", ["pins", "wheels"])
+@pytest.mark.parametrize("size", ["width", "height"])
+@pytest.mark.parametrize("value", [0, -1])
+def test_bodies_need_a_positive_size(data, key, size, value):
+    data[key][0][size] = value
+    with pytest.raises(TrackError, match=f"{size} must be positive"):
+        Track("test", data)
+
+
+def test_marbles_spawn_on_the_track_grid(data):
+    data["spawn"] = {"x": 10, "y": 4, "columns": 3, "spacing_x": 0.5, "spacing_y": 1}
+    engine = PhysicsEngine([f"m{i}" for i in range(5)], track=Track("test", data))
+    positions = [tuple(m['body'].position) for m in engine.marbles]
+    assert positions == [(10, 4), (10.5, 4), (11, 4), (10, 3), (10.5, 3)]
+
+
+def test_camera_zoom_follows_the_bands(data):
+    data["camera"] = {"bands": [{"until_y": 40, "zoom": [10, 20]}, {"until_y": 100, "zoom": [20, 50]}]}
+    engine = PhysicsEngine(["a"], track=Track("test", data))
+    engine.marbles[0]['body'].position = (12, 70)
+    engine.after_step(0)
+    assert engine.camera_target_zoom == pytest.approx(35)
@@ -0,0 +1,113 @@
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from physics_engine import PhysicsEngine
+from step_policy import make_step_policy
+from track import DEFAULT_TRACK, load_track
+
+HEAT_SIZE = int(os.environ.get("TOURNAMENT_HEAT_SIZE", 100))
+FINALISTS_PER_HEAT = int(os.environ.get("TOURNAMENT_FINALISTS_PER_HEAT", 10))
+TOURNAMENT_WORKERS = int(os.environ.get("TOURNAMENT_WORKERS", os.cpu_count() or 1))
+HEAT_MAX_STEPS = 200000
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=TOURNAMENT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def reset_executor():
+    # A worker that dies (e.g. killed for memory) breaks the whole pool, so
+    # drop it and let the next tournament start a fresh one.
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def shutdown_executor():
+    # Under eventlet the pool's management thread is a green thread, which
+    # the interpreter's exit hook cannot join; shut it down from the hub.
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+
+def needs_tournament(names):
+    return len(names) > HEAT_SIZE
+
+
+def split_heats(names, heat_size=HEAT_SIZE):
+    heat_count = math.ceil(len(names) / heat_size)
+    return [names[i::heat_count] for i in range(heat_count)]
+
+
+def run_heat(names, advance, allow_sleep=False, track_name=DEFAULT_TRACK):
+    # The lottery is won by the last marble still on the track, so a heat
+    # advances the marbles that remain once everyone else has finished.
+    engine = PhysicsEngine(
+        names, allow_sleep=allow_sleep, track=load_track(track_name),
+        step_policy=make_step_policy()
+    )
+    engine.start()
+
+    steps = 0
+    while steps < HEAT_MAX_STEPS:
+        remaining = len(engine.marbles) - len(engine.winners)
+        if remaining <= advance:
+            break
+        engine.step()
+        steps += 1
+
+    remaining = [m for m in engine.marbles if not m["finished"]]
+    remaining.sort(key=lambda m: m["body"].position.y)
+    return [m["name"] for m in remaining[:advance]]
+
+
+def heat_advance(heats, rank, final_size):
+    advance = max(rank, FINALISTS_PER_HEAT)
+    if len(heats) * advance <= final_size:
+        return advance
+    # Too many finalists for one final: halve every heat at least, but never
+    # thin the field below what the final needs.
+    shortest = min(len(heat) for heat in heats)
+    return max(min(advance, shortest // 2), math.ceil(final_size / len(heats)), 1)
+
+
+def run_heats(names, rank=1, allow_sleep=False, track_name=DEFAULT_TRACK, wait=wait):
+    # Heat rounds repeat on the finalists until the final fits in one heat,
+    # so no engine ever holds more than HEAT_SIZE marbles (or rank, if a
+    # larger number of places was asked for). ``wait`` blocks until a round's
+    # futures are done; eventlet servers pass one that yields to the hub.
+    final_size = max(HEAT_SIZE, rank)
+    executor = get_executor()
+    while len(names) > final_size:
+        heats = split_heats(names)
+        advance = heat_advance(heats, rank, final_size)
+        finalists = []
+        try:
+            futures = [
+                executor.submit(run_heat, heat, advance, allow_sleep, track_name)
+                for heat in heats
+            ]
+            wait(futures)
+            for future in futures:
+                finalists.extend(future.result())
+        except BrokenProcessPool:
+            reset_executor()
+            raise
+        if len(finalists) >= len(names):
+            break
+        names = finalists
+    return names
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+
+TRACK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tracks")
+DEFAULT_TRACK = os.environ.get("DEFAULT_TRACK", "default")
+TRACK_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+_tracks = {}
+_tracks_by_hash = {}
+_lock = threading.Lock()
+
+
+class TrackError(ValueError):
+    pass
+
+
+def _number(value, where):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise TrackError(f"{where} must be a number")
+    return float(value)
+
+
+def _positive(value, where):
+    number = _number(value, where)
+    if number <= 0:
+        raise TrackError(f"{where} must be positive")
+    return number
+
+
+def _point(value, where):
+    if not isinstance(value, list) or len(value) != 2:
+        raise TrackError(f"{where} must be an [x, y] pair")
+    return [_number(value[0], where), _number(value[1], where)]
+
+
+def _list(data, key):
+    value = data.get(key, [])
+    if not isinstance(value, list):
+        raise TrackError(f"{key} must be a list")
+    return value
+
+
+class Track:
+    def __init__(self, name, data):
+        if not isinstance(data, dict):
+            raise TrackError("track must be an object")
+
+        self.name = name
+        self.goal_y = _number(data.get("goal_y"), "goal_y")
+
+        self.walls = []
+        for i, wall in enumerate(_list(data, "walls")):
+            if not isinstance(wall, list) or len(wall) < 2:
+                raise TrackError(f"walls[{i}] needs at least two points")
+            self.walls.append([_point(p, f"walls[{i}]") for p in wall])
+
+        self.pins = []
+        for i, group in enumerate(_list(data, "pins")):
+            where = f"pins[{i}]"
+            if not isinstance(group, dict):
+                raise TrackError(f"{where} must be an object")
+            width = _positive(group.get("width"), f"{where}.width")
+            height = _positive(group.get("height"), f"{where}.height")
+            angle = _number(group.get("angle", 0), f"{where}.angle")
+            restitution = _number(group.get("restitution", 0), f"{where}.restitution")
+            positions = group.get("positions", [])
+            if not isinstance(positions, list):
+                raise TrackError(f"{where}.positions must be a list")
+            for position in positions:
+                x, y = _point(position, f"{where}.positions")
+                self.pins.append({
+                    'x': x, 'y': y, 'width': width, 'height': height,
+                    'angle': angle, 'restitution': restitution
+                })
+
+        self.wheels = []
+        for i, wheel in enumerate(_list(data, "wheels")):
+            where = f"wheels[{i}]"
+            if not isinstance(wheel, dict):
+                raise TrackError(f"{where} must be an object")
+            self.wheels.append({
+                'x': _number(wheel.get("x"), f"{where}.x"),
+                'y': _number(wheel.get("y"), f"{where}.y"),
+                'width': _positive(wheel.get("width"), f"{where}.width"),
+                'height': _positive(wheel.get("height"), f"{where}.height"),
+                'angular_velocity': _number(wheel.get("angular_velocity"), f"{where}.angular_velocity")
+            })
+
+        spawn = data.get("spawn")
+        if not isinstance(spawn, dict):
+            raise TrackError("spawn must be an object")
+        columns = spawn.get("columns")
+        if isinstance(columns, bool) or not isinstance(columns, int) or columns < 1:
+            raise TrackError("spawn.columns must be a positive whole number")
+        # Marbles start on a grid of ``columns`` per row, filling rows
+        # upwards (towards negative y) from the first one.
+        self.spawn = {
+            'x': _number(spawn.get("x"), "spawn.x"),
+            'y': _number(spawn.get("y"), "spawn.y"),
+            'columns': columns,
+            'spacing_x': _number(spawn.get("spacing_x"), "spawn.spacing_x"),
+            'spacing_y': _number(spawn.get("spacing_y"), "spawn.spacing_y"),
+        }
+
+        # The camera zooms out as the leading marble falls: each band runs
+        # from the previous band's end (or the top) down to ``until_y`` and
+        # eases the zoom between its [start, end] pair.
+        camera = data.get("camera", {})
+        if not isinstance(camera, dict):
+            raise TrackError("camera must be an object")
+        self.camera_bands = []
+        band_start = 0.0
+        for i, band in enumerate(_list(camera, "bands")):
+            where = f"camera.bands[{i}]"
+            if not isinstance(band, dict):
+                raise TrackError(f"{where} must be an object")
+            until_y = _number(band.get("until_y"), f"{where}.until_y")
+            if until_y <= band_start:
+                raise TrackError(f"{where}.until_y must be below the previous band")
+            zoom = band.get("zoom")
+            if not isinstance(zoom, list) or len(zoom) != 2:
+                raise TrackError(f"{where}.zoom must be a [start, end] pair")
+            self.camera_bands.append({
+                'start_y': band_start, 'until_y': until_y,
+                'zoom_from': _positive(zoom[0], f"{where}.zoom"),
+                'zoom_to': _positive(zoom[1], f"{where}.zoom")
+            })
+            band_start = until_y
+
+        # Horizontal extent of everything a marble can touch, used to lay
+        # several copies of the track side by side in one space.
+        xs = [x for wall in self.walls for x, _ in wall]
+        for body in self.pins + self.wheels:
+            reach = math.hypot(body['width'], body['height'])
+            xs += [body['x'] - reach, body['x'] + reach]
+        if not xs:
+            raise TrackError("track has no walls")
+        self.min_x = min(xs)
+        self.max_x = max(xs)
+
+        client_data = {
+            'walls': self.walls,
+            'pins': [
+                {k: pin[k] for k in ('x', 'y', 'width', 'height', 'angle')}
+                for pin in self.pins
+            ],
+            'goal_y': self.goal_y
+        }
+        canonical = json.dumps(client_data, sort_keys=True, separators=(",", ":"))
+        self.hash = hashlib.sha256(canonical.encode()).hexdigest()[:16]
+        client_data['hash'] = self.hash
+        self.payload = json.dumps(client_data, separators=(",", ":")).encode()
+
+
+def load_track(name=DEFAULT_TRACK):
+    if not isinstance(name, str):
+        raise TrackError("Track name must be a string")
+    track = _tracks.get(name)
+    if track is not None:
+        return track
+
+    if not TRACK_NAME_PATTERN.match(name):
+        raise TrackError(f"Invalid track name: {name}")
+    path = os.path.join(TRACK_DIR, name + ".json")
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        raise TrackError(f"Unknown track: {name}")
+    except json.JSONDecodeError as e:
+        raise TrackError(f"Track {name} is not valid JSON: {e}")
+
+    track = Track(name, data)
+    with _lock:
+        track = _tracks.setdefault(name, track)
+        _tracks_by_hash[track.hash] = track
+    return track
+
+
+def get_track_by_hash(track_hash):
+    return _tracks_by_hash.get(track_hash)
@@ -0,0 +1,46 @@
+import threading
+
+
+class ViewerRegistry:
+    def __init__(self):
+        self.rooms = {}
+        self.client_rooms = {}
+        self.lock = threading.Lock()
+
+    def join(self, room, sid, fmt):
+        with self.lock:
+            viewers = self.rooms.setdefault(room, {})
+            viewers[sid] = fmt
+            self.client_rooms.setdefault(sid, set()).add(room)
+            return len(viewers) == 1
+
+    def leave_all(self, sid):
+        emptied = []
+        with self.lock:
+            for room in self.client_rooms.pop(sid, set()):
+                viewers = self.rooms.get(room)
+                if viewers is None:
+                    continue
+                viewers.pop(sid, None)
+                if not viewers:
+                    del self.rooms[room]
+                    emptied.append(room)
+        return emptied
+
+    def room_names(self):
+        with self.lock:
+            return list(self.rooms)
+
+    def count(self, room):
+        return len(self.rooms.get(room, ()))
+
+    def formats(self, room):
+        with self.lock:
+            return set(self.rooms.get(room, {}).values())
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "rooms": len(self.rooms),
+                "viewers": sum(len(v) for v in self.rooms.values()),
+            }